@@ -0,0 +1,328 @@
+# Copyright 2016 Time Warner Cable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-process stand-in for the Grafana endpoints used by the managers.
+
+Payloads are generated once at start-up so the server itself adds as
+little noise as possible to client measurements.
+"""
+
+import json
+import re
+import threading
+import time
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib.parse import parse_qs
+from six.moves.urllib.parse import urlparse
+
+# Results Grafana returns from unpaged /api/search and /api/users calls.
+LIST_LIMIT = 1000
+
+
+def make_dashboard(id, panels):
+    return {
+        'id': id,
+        'uid': 'dash%05d' % id,
+        'title': 'Dashboard %d' % id,
+        'version': 1,
+        'tags': ['bench'],
+        'templating': {'list': [{'name': 'host', 'query': 'label_values(up, host)',
+                                 'datasource': 'prometheus'}]},
+        'panels': [{
+            'id': p,
+            'type': 'graph',
+            'title': 'Panel %d' % p,
+            'datasource': 'prometheus',
+            'gridPos': {'x': 0, 'y': p * 8, 'w': 24, 'h': 8},
+            'targets': [{'refId': 'A',
+                         'expr': 'rate(http_requests_total{host="$host",'
+                                 'panel="%d"}[5m])' % p}],
+        } for p in range(1, panels + 1)],
+    }
+
+
+class FakeGrafana(object):
+    """Threaded fake Grafana server.
+
+    :param orgs: number of orgs
+    :param users: number of users (each member of every org)
+    :param dashboards: number of dashboards
+    :param panels: panels per dashboard, controls dashboard payload size
+    :param datasources: number of datasources
+    :param render_bytes: size of every rendered image
+    :param latency: seconds slept before answering each request
+    """
+
+    def __init__(self, orgs=10, users=1000, dashboards=100, panels=50,
+                 datasources=20, render_bytes=1024 * 1024, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        # Connections opened since the last reset_connections() call.
+        self.connections = 0
+        self.max_connections = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.orgs = [{'id': i, 'name': 'Org %d' % i}
+                     for i in range(1, orgs + 1)]
+        self.users = [{'id': i, 'login': 'user%d' % i,
+                       'email': 'user%d@example.com' % i,
+                       'name': 'User %d' % i, 'isAdmin': False,
+                       'lastSeenAt': '2016-01-01T00:00:00Z',
+                       'lastSeenAtAge': '1y'}
+                      for i in range(1, users + 1)]
+        self.dashboards = dict((i, make_dashboard(i, panels))
+                               for i in range(1, dashboards + 1))
+        self.datasources = [{'id': i, 'uid': 'ds%d' % i,
+                             'name': 'datasource%d' % i,
+                             'type': 'prometheus', 'access': 'proxy',
+                             'url': 'http://prometheus:9090'}
+                            for i in range(1, datasources + 1)]
+        self.image = b'\x89PNG\r\n\x1a\n' + b'\0' * max(0, render_bytes - 8)
+        self._search = json.dumps([self._hit(d) for d in
+                                   self.dashboards.values()]).encode()
+        self._dashboard_docs = dict(
+            (d['uid'], json.dumps({'dashboard': d,
+                                   'meta': dict(self._folder(d),
+                                                slug=self._slug(d),
+                                                version=1)}).encode())
+            for d in self.dashboards.values())
+        for d in self.dashboards.values():
+            self._dashboard_docs[self._slug(d)] = \
+                self._dashboard_docs[d['uid']]
+        self.server = None
+
+    @staticmethod
+    def _slug(dashboard):
+        return 'dashboard-%d' % dashboard['id']
+
+    @staticmethod
+    def _folder(dashboard):
+        # Even dashboards live in the "Bench" folder, odd ones in General.
+        if dashboard['id'] % 2:
+            return {'folderId': 0, 'folderUid': '', 'folderTitle': 'General'}
+        return {'folderId': 1, 'folderUid': 'folder1', 'folderTitle': 'Bench'}
+
+    def _hit(self, dashboard):
+        hit = {'id': dashboard['id'], 'uid': dashboard['uid'],
+               'title': dashboard['title'],
+               'uri': 'db/%s' % self._slug(dashboard),
+               'type': 'dash-db', 'tags': dashboard['tags'],
+               'isStarred': False}
+        if dashboard['id'] % 2 == 0:
+            hit.update(self._folder(dashboard))
+        return hit
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def start(self):
+        handler = type('Handler', (_Handler,), {'grafana': self})
+        self.server = _Server(('127.0.0.1', 0), handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def reset_connections(self):
+        """Only count connections opened from now on."""
+        with self._lock:
+            self._generation += 1
+            self.connections = self.max_connections = 0
+
+    def connection_made(self):
+        """Count a new connection; returns its generation."""
+        with self._lock:
+            self.connections += 1
+            self.max_connections = max(self.max_connections,
+                                       self.connections)
+            return self._generation
+
+    def connection_lost(self, generation):
+        with self._lock:
+            if generation == self._generation:
+                self.connections -= 1
+
+    def route(self, method, path, query, body, org_id=None):
+        """Return ``(status, content type, payload)`` for a request.
+
+        `org_id` is the org of the X-Grafana-Org-Id header, if any.
+        """
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if path == '/login':
+            return 200, 'application/json', {'message': 'Logged in'}
+        if path == '/api/search':
+            if 'limit' in query:
+                limit = int(query['limit'][0])
+                page = int(query.get('page', ['1'])[0])
+                hits = json.loads(self._search.decode())
+                return 200, 'application/json', \
+                    hits[(page - 1) * limit:page * limit]
+            if len(self.dashboards) > LIST_LIMIT:
+                hits = json.loads(self._search.decode())[:LIST_LIMIT]
+                return 200, 'application/json', hits
+            return 200, 'application/json', self._search
+        match = re.match(r'/api/dashboards/(?:db|uid)/([^/]+)$', path)
+        if match and method == 'GET':
+            doc = self._dashboard_docs.get(match.group(1))
+            if doc is None:
+                return 404, 'application/json', {'message': 'Not found'}
+            return 200, 'application/json', doc
+        if match and method == 'DELETE':
+            return 200, 'application/json', {'message': 'Dashboard deleted'}
+        if path in ('/api/dashboards/db', '/api/dashboards/import'):
+            dashboard = json.loads(body.decode())['dashboard']
+            return 200, 'application/json', {
+                'status': 'success', 'id': dashboard.get('id') or 0,
+                'uid': dashboard.get('uid'), 'version': 2}
+        if path == '/api/dashboards/tags':
+            return 200, 'application/json', [{'term': 'bench', 'count': 1}]
+        if path == '/api/orgs':
+            if method == 'POST':
+                return 200, 'application/json', {'orgId': len(self.orgs) + 1}
+            return 200, 'application/json', self.orgs
+        if path == '/api/org':
+            return 200, 'application/json', self.orgs[(org_id or 1) - 1]
+        if re.match(r'/api/orgs/\d+$', path):
+            return 200, 'application/json', self.orgs[0]
+        match = re.match(r'/api/orgs?(?:/(\d+))?/users(/search)?$', path)
+        if match:
+            org_id = int(match.group(1) or 1)
+            members = [{'orgId': org_id, 'userId': u['id'],
+                        'login': u['login'], 'email': u['email'],
+                        'role': 'Viewer'} for u in self.users]
+            if method != 'GET':
+                return 200, 'application/json', {'message': 'ok'}
+            if match.group(2):
+                return 200, 'application/json', self._page(
+                    query, members, 'orgUsers')
+            return 200, 'application/json', members
+        if path == '/api/users':
+            return 200, 'application/json', self.users[:LIST_LIMIT]
+        if path == '/api/users/search':
+            return 200, 'application/json', self._page(query, self.users,
+                                                       'users')
+        match = re.match(r'/api/users/(\d+)$', path)
+        if match:
+            user_id = int(match.group(1))
+            if not 0 < user_id <= len(self.users):
+                return 404, 'application/json', {'message': 'User not found'}
+            return 200, 'application/json', self.users[user_id - 1]
+        if path == '/api/user':
+            return 200, 'application/json', self.users[0]
+        if path.startswith('/api/user/using/'):
+            return 200, 'application/json', {'message': 'Active organization changed'}
+        if path == '/api/admin/users':
+            return 200, 'application/json', {'id': len(self.users) + 1}
+        if path == '/api/datasources':
+            if method == 'POST':
+                return 200, 'application/json', {'id': 0, 'message': 'ok'}
+            return 200, 'application/json', self.datasources
+        match = re.match(r'/api/datasources/(?:uid/)?(\w+)/health$', path)
+        if match:
+            return 200, 'application/json', {'status': 'OK',
+                                              'message': 'Data source is working'}
+        match = re.match(r'/api/datasources/(\d+)$', path)
+        if match:
+            if method == 'GET':
+                return 200, 'application/json', \
+                    self.datasources[int(match.group(1)) - 1]
+            return 200, 'application/json', {'message': 'ok'}
+        if path.startswith('/render/'):
+            return 200, 'image/png', self.image
+        return 404, 'application/json', {'message': 'Not found'}
+
+    @staticmethod
+    def _page(query, items, key):
+        perpage = int(query.get('perpage', ['1000'])[0])
+        page = int(query.get('page', ['1'])[0])
+        return {key: items[(page - 1) * perpage:page * perpage],
+                'totalCount': len(items), 'page': page, 'perPage': perpage}
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment and never wait on delayed ACKs,
+    # which would otherwise dominate every keep-alive request.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    grafana = None
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.generation = self.grafana.connection_made()
+
+    def finish(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        finally:
+            self.grafana.connection_lost(self.generation)
+
+    def _handle(self, method):
+        parsed = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        org_id = self.headers.get('X-Grafana-Org-Id')
+        status, content_type, payload = self.grafana.route(
+            method, parsed.path, parse_qs(parsed.query), body,
+            int(org_id) if org_id else None)
+        if not isinstance(payload, bytes):
+            payload = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        if parsed.path == '/login':
+            self.send_header('Set-Cookie', 'grafana_sess=bench; Path=/')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
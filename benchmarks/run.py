@@ -0,0 +1,376 @@
+# Copyright 2016 Time Warner Cable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Client benchmarks against the in-process fake Grafana server.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --compare results.json --output new.json
+
+Every scenario reports per-operation timings; --compare prints the change
+of the median against an earlier results file.
+"""
+
+from __future__ import print_function
+
+import argparse
+import importlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+from fakegrafana import FakeGrafana
+
+# Benchmark the checkout this script lives in, importing it as a package
+# named after its directory.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+sys.path.insert(0, os.path.dirname(ROOT))
+client = importlib.import_module(PACKAGE + '.client')
+jsonutils = importlib.import_module(PACKAGE + '.utils.jsonutils')
+jsonpatch = importlib.import_module(PACKAGE + '.utils.jsonpatch')
+base = importlib.import_module(PACKAGE + '.utils.base')
+
+SCENARIOS = []
+
+
+def scenario(func):
+    SCENARIOS.append(func)
+    return func
+
+
+def measure(func, repeat):
+    """Call `func` `repeat` times and summarize the durations."""
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return summarize(timings)
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    mean = sum(timings) / len(timings)
+    return {
+        'n': len(timings),
+        'mean': mean,
+        'median': timings[len(timings) // 2],
+        'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'min': timings[0],
+        'ops_per_sec': 1 / mean if mean else None,
+    }
+
+
+def new_client(server, **kwargs):
+    return client.Client(server.url, username='admin', password='admin',
+                         **kwargs)
+
+
+@scenario
+def list_orgs(server, args):
+    c = new_client(server)
+    return measure(c.orgs.list, args.repeat)
+
+
+@scenario
+def list_users(server, args):
+    c = new_client(server)
+    return measure(c.users.list, args.repeat)
+
+
+@scenario
+def search_dashboards(server, args):
+    c = new_client(server)
+    return measure(c.dashboards.list, args.repeat)
+
+
+@scenario
+def get_large_dashboard(server, args):
+    c = new_client(server)
+    return measure(lambda: c.dashboards.get('db/dashboard-1'), args.repeat)
+
+
+@scenario
+def update_large_dashboard(server, args):
+    c = new_client(server)
+    dashboard = c.dashboards.get('db/dashboard-1')._json['dashboard']
+    return measure(lambda: c.dashboards.update(1, dashboard), args.repeat)
+
+
+@scenario
+def patch_large_dashboard(server, args):
+    """One-field change: path-copying patch vs copy-and-edit, and diff."""
+    dashboard = server.dashboards[1]
+    last = len(dashboard['panels']) - 1
+    path = '/panels/%d/targets/0/expr' % last
+    patch = [{'op': 'replace', 'path': path, 'value': 'up'}]
+
+    def copy_and_edit():
+        doc = base.copy_json(dashboard)
+        doc['panels'][last]['targets'][0]['expr'] = 'up'
+        return doc
+
+    patched = jsonpatch.apply(dashboard, patch)
+    return {
+        'bytes': len(json.dumps(dashboard)),
+        'apply': measure(lambda: jsonpatch.apply(dashboard, patch),
+                         args.repeat),
+        'copy_and_edit': measure(copy_and_edit, args.repeat),
+        'diff_patched': measure(lambda: jsonpatch.diff(dashboard, patched),
+                                args.repeat),
+        'diff_copy': measure(lambda: jsonpatch.diff(dashboard,
+                                                    copy_and_edit()),
+                             args.repeat),
+    }
+
+
+@scenario
+def transform_dashboards(server, args):
+    """Bulk datasource rename matching no dashboard vs every dashboard."""
+    dashboards = importlib.import_module(PACKAGE + '.dashboards')
+    c = new_client(server)
+    noop = dashboards.datasource_rename('missing', 'other')
+    rename = dashboards.datasource_rename('prometheus', 'thanos')
+    return {
+        'noop': measure(lambda: c.dashboards.transform(noop), args.repeat),
+        'rename': measure(lambda: c.dashboards.transform(rename),
+                          args.repeat),
+    }
+
+
+@scenario
+def render_download(server, args):
+    c = new_client(server)
+
+    def render():
+        c.renderer.render('dashboard-1', 0, 1, 1, output=io.BytesIO())
+    return measure(render, args.repeat)
+
+
+@scenario
+def switch_org(server, args):
+    c = new_client(server)
+    names = [org['name'] for org in server.orgs]
+    state = {'i': 0}
+
+    def switch():
+        state['i'] += 1
+        c.switch_org(names[state['i'] % len(names)])
+    return measure(switch, args.repeat)
+
+
+@scenario
+def json_decode_dashboard(server, args):
+    doc = json.dumps({'dashboard': server.dashboards[1]}).encode()
+    result = {'bytes': len(doc)}
+    backend = jsonutils.get_backend()
+    for name in sorted(jsonutils.BACKENDS):
+        try:
+            jsonutils.set_backend(name)
+        except ImportError:
+            continue
+        result[name] = measure(lambda: jsonutils.loads(doc), args.repeat)
+    jsonutils.set_backend(backend)
+    return result
+
+
+@scenario
+def resource_construction(server, args):
+    result = {'resources': len(server.users)}
+    for compact in (False, True):
+        c = new_client(server, compact_resources=compact)
+        users = [dict(u) for u in server.users]
+        key = 'compact' if compact else 'default'
+        # Instances of a class share one attribute key table in CPython,
+        # sized by every attribute ever set on any of them; a fresh class
+        # per mode keeps the default mode's fields out of compact objects.
+        cls = type('User_' + key, (c.users.resource_class,), {})
+        result[key] = measure(
+            lambda: [cls(c.users, u) for u in users], args.repeat)
+        try:
+            import tracemalloc
+        except ImportError:
+            continue
+        tracemalloc.start()
+        objects = [cls(c.users, u) for u in users]
+        result[key]['bytes'] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del objects
+    return result
+
+
+@scenario
+def hooks_overhead(server, args):
+    class NoopHook(object):
+        def before_request(self, event):
+            pass
+
+        def after_request(self, event):
+            pass
+
+    result = {}
+    for name, hooks in (('without_hooks', []), ('with_hook', [NoopHook()])):
+        c = new_client(server, hooks=hooks)
+        result[name] = measure(lambda: c.orgs.get(), args.repeat)
+    return result
+
+
+@scenario
+def import_time(server, args):
+    """Cold import of the client module in a fresh interpreter."""
+    code = ('import time; start = time.time(); import %s.client; '
+            'print(time.time() - start)' % PACKAGE)
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(ROOT))
+    timings = []
+    for _ in range(min(args.repeat, 20)):
+        out = subprocess.check_output([sys.executable, '-c', code], env=env)
+        timings.append(float(out.strip()))
+    return summarize(timings)
+
+
+@scenario
+def datasource_health_sweep(server, args):
+    """Probing every datasource one at a time vs concurrently."""
+    c = new_client(server)
+    datasources = c.datasources.list()
+    result = {'datasources': len(datasources)}
+    for workers in (1, 16):
+        result['workers_%d' % workers] = measure(
+            lambda: list(c.datasources.check_all(datasources,
+                                                 max_workers=workers)),
+            max(1, args.repeat // 10))
+    return result
+
+
+@scenario
+def client_pool_stress(server, args):
+    """Many threads sharing a ClientPool across every org.
+
+    Fails if a response belongs to another org than the client asked for,
+    or if more connections than allowed were open at once.
+    """
+    threads, max_connections = 32, 4
+    org_ids = [org['id'] for org in server.orgs]
+    errors = []
+
+    with client.ClientPool(server.url, username='admin', password='admin',
+                           max_connections=max_connections) as pool:
+        def work(i):
+            for n in range(args.repeat):
+                org_id = org_ids[(i + n) % len(org_ids)]
+                try:
+                    org = pool.get(org_id).orgs.get()
+                except Exception as e:
+                    errors.append(e)
+                else:
+                    if org.id != org_id:
+                        errors.append('asked org %s, got %s' % (org_id,
+                                                               org.id))
+
+        # Earlier scenarios may leave keep-alive connections open.
+        server.reset_connections()
+        start = time.time()
+        workers = [threading.Thread(target=work, args=(i,))
+                   for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+        peak = server.max_connections
+
+    if errors:
+        raise AssertionError('%d errors, e.g. %s' % (len(errors), errors[0]))
+    if peak > max_connections:
+        raise AssertionError('%d connections open at once, limit %d' %
+                             (peak, max_connections))
+    requests = threads * args.repeat
+    return {'threads': threads, 'requests': requests,
+            'max_connections': max_connections, 'peak_connections': peak,
+            'seconds': elapsed, 'ops_per_sec': requests / elapsed}
+
+
+def compare(previous, current):
+    """Print the median change of every scenario found in both runs."""
+    def medians(results, prefix=''):
+        for name, value in sorted(results.items()):
+            if isinstance(value, dict) and 'median' in value:
+                yield prefix + name, value['median']
+            elif isinstance(value, dict):
+                for item in medians(value, prefix + name + '.'):
+                    yield item
+
+    before = dict(medians(previous['results']))
+    for name, median in medians(current['results']):
+        if name in before and before[name]:
+            print('%-45s %10.6fs %+7.1f%%' % (
+                name, median, (median / before[name] - 1) * 100))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='earlier results file')
+    parser.add_argument('--scenario', action='append',
+                        help='run only these scenarios')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the fake server waits per request')
+    parser.add_argument('--orgs', type=int, default=10)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--dashboards', type=int, default=100)
+    parser.add_argument('--panels', type=int, default=50,
+                        help='panels per dashboard (payload size)')
+    parser.add_argument('--render-bytes', type=int, default=1024 * 1024)
+    args = parser.parse_args(argv)
+
+    config = dict((k, v) for k, v in vars(args).items()
+                  if k not in ('output', 'compare', 'scenario'))
+    results = {}
+    with FakeGrafana(orgs=args.orgs, users=args.users,
+                     dashboards=args.dashboards, panels=args.panels,
+                     render_bytes=args.render_bytes,
+                     latency=args.latency) as server:
+        for func in SCENARIOS:
+            if args.scenario and func.__name__ not in args.scenario:
+                continue
+            results[func.__name__] = func(server, args)
+            print('%-25s done' % func.__name__, file=sys.stderr)
+
+    run = {
+        'meta': {'timestamp': time.time(),
+                 'python': platform.python_version(),
+                 'json_backend': jsonutils.get_backend(),
+                 'config': config},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(run, indent=2, sort_keys=True))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), run)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,26 @@
-from twcmanage.lib.grafanaclient.utils import http
-import organizations
-import users
-import dashboards
-import datasources
-import renderer
+import importlib
 import time
 
+from .utils import http
+
+
+class _LazyManager(object):
+    """Creates a manager, importing its module, on first access."""
+
+    def __init__(self, name, module, cls):
+        self.name = name
+        self.module = module
+        self.cls = cls
+
+    def __get__(self, client, owner):
+        if client is None:
+            return self
+        module = importlib.import_module('.' + self.module, __package__)
+        manager = getattr(module, self.cls)(client.http_client)
+        # Cache on the instance; it takes precedence over this descriptor.
+        # setdefault keeps threads racing on first access on one manager.
+        return client.__dict__.setdefault(self.name, manager)
+
 
 class Client(object):
 
@@ -16,38 +31,306 @@ class Client(object):
     :param string token: Api Token for authentication.
     :param integer timeout: Allows customization of the timeout for client
                             http requests. (optional)
+
+    Connection pool settings (``pool_connections``, ``pool_maxsize``,
+    ``pool_block``, ``keep_alive``) are passed through to
+    :class:`utils.http.HTTPClient`. The client can be used as a context
+    manager to close the pool when done.
+
+    An existing HTTPClient can be wrapped with ``Client(http_client=...)``.
+
+    Managers are imported and created on first access, and nothing is sent
+    to Grafana until the first API call.
+
+    A Client can be shared by many threads. Pass ``thread_safe=True`` to
+    also make switch_org, which changes the user's current org for every
+    thread, raise instead; use scoped() or a ClientPool to act on several
+    orgs.
     """
 
+    orgs = _LazyManager('orgs', 'organizations', 'OrganizationManager')
+    users = _LazyManager('users', 'users', 'UserManager')
+    dashboards = _LazyManager('dashboards', 'dashboards', 'DashboardManager')
+    datasources = _LazyManager('datasources', 'datasources',
+                               'DatasourceManager')
+    renderer = _LazyManager('renderer', 'renderer', 'Renderer')
+
     def __init__(self, *args, **kwargs):
         """Initialize a new http client for the grafana API."""
-        self.http_client = http.HTTPClient(*args, **kwargs)
-        self.http_client.login()
-        self.orgs = organizations.OrganizationManager(self.http_client)
-        self.users = users.UserManager(self.http_client)
-        self.dashboards = dashboards.DashboardManager(self.http_client)
-        self.datasources = datasources.DatasourceManager(self.http_client)
-        self.renderer = renderer.Renderer(self.http_client)
+        self.http_client = kwargs.pop('http_client', None)
+        if self.http_client is None:
+            self.http_client = http.HTTPClient(*args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the underlying connection pool."""
+        self.http_client.close()
 
     def get_org(self):
         return self.orgs.get()
 
     def switch_org(self, orgname=None, orgid=None):
+        """Switch the current org by name or id.
+
+        Raises NotFound if no org is called `orgname`.
+        """
         if orgname:
-            orgs = self.orgs.list()
-            for org in orgs:
-                if org.name == orgname:
-                    orgid = org.id
+            orgid = self.orgs.by_name(orgname).id
         return self.users.orgs.switch_current(orgid)
 
-    def render(self, slug, panel=1, from_time=None, to_time=None, timeout=None, output=None):
+    def scoped(self, orgid):
+        """Return a client acting on org `orgid` over the same connections.
+
+        Requests carry the X-Grafana-Org-Id header instead of switching the
+        user's current org, so scoped clients are safe to use in parallel.
+        """
+        return Client(http_client=self.http_client.scoped(orgid))
+
+    def fan_out(self, func, orgs=None, where=None, max_workers=8):
+        """Run `func` against many orgs concurrently.
+
+        :param func: callable invoked as ``func(client, org)`` with a client
+            scoped to the org and the org's Organization resource
+        :param orgs: org ids or Organization resources to run against
+            (defaults to every org)
+        :param where: optional predicate filtering the Organization resources
+        :param max_workers: maximum number of orgs processed at once
+        :returns: BatchResult mapping org id to the result of `func`, with
+            the exceptions of failed orgs in `errors`
+        """
+        from .utils import concurrency
+
+        if orgs is None:
+            orgs = self.orgs.list()
+        else:
+            orgs = [org if hasattr(org, 'id') else self.orgs.get(org)
+                    for org in orgs]
+        if where is not None:
+            orgs = [org for org in orgs if where(org)]
+        return concurrency.run_batch(
+            lambda org: func(self.scoped(org.id), org), orgs,
+            key=lambda org: org.id, max_workers=max_workers)
+
+    def reconcile(self, desired, dry_run=False, prune=False, max_workers=8):
+        """Bring the instance to the `desired` state with minimal writes.
+
+        See reconcile.Reconciler for the format of `desired`. With
+        `dry_run` the plan is printed and returned without writing.
+        """
+        from . import reconcile
+
+        reconciler = reconcile.Reconciler(self, prune=prune,
+                                          max_workers=max_workers)
+        return reconciler.reconcile(desired, dry_run=dry_run)
+
+    def snapshot(self, path, max_workers=8):
+        """Write a snapshot of the whole instance to the archive at `path`.
+
+        See snapshot.Snapshotter. Needs a Grafana server admin.
+        """
+        from . import snapshot
+
+        return snapshot.Snapshotter(self, max_workers).snapshot(path)
+
+    def restore(self, path, password=None, max_workers=8):
+        """Restore the snapshot archive at `path` into this instance.
+
+        :param password: password of restored users that did not exist
+            (a random one per user by default)
+        """
+        from . import snapshot
+
+        return snapshot.Snapshotter(self, max_workers).restore(
+            path, password=password)
+
+    def render(self, slug, panel=1, from_time=None, to_time=None, timeout=60,
+               output=None, **kwargs):
+        """Render a panel to `output` (defaults to ``<slug>-<panel>.png``).
+
+        The image is streamed to disk. Extra keyword arguments such as
+        `width`, `height` and `theme` are passed to Renderer.render.
+        """
         if not to_time:
             to_time = time.time()
         if not from_time:
             from_time = to_time - 6 * 60 * 60
-        response = self.renderer.render(slug, int(from_time * 1000), int(to_time * 1000), panel,
-                                        timeout=60)
         if not output:
             output = "%s-%s.png" % (slug, panel)
-        data = bytearray(response.content)
-        with open(output, 'w') as f:
-            f.write(data)
+        return self.renderer.render(slug, int(from_time * 1000),
+                                    int(to_time * 1000), panel, output=output,
+                                    timeout=timeout, **kwargs)
+
+    def render_dashboards(self, slugs, from_time=None, to_time=None,
+                          directory='.', **kwargs):
+        """Render every panel of the given dashboards.
+
+        Panel ids are read from each dashboard's JSON. Times default to the
+        last six hours. Extra keyword arguments (`max_workers`, `timeout`,
+        `retries`, `manifest`, ...) are passed to Renderer.render_many.
+
+        :returns: render manifest
+        """
+        from . import renderer
+
+        if not to_time:
+            to_time = time.time()
+        if not from_time:
+            from_time = to_time - 6 * 60 * 60
+        jobs = []
+        for slug in slugs:
+            dashboard = self.dashboards.get('db/%s' % slug)._json['dashboard']
+            for panel in renderer.panel_ids(dashboard):
+                jobs.append((slug, panel, int(from_time * 1000),
+                             int(to_time * 1000)))
+        return self.renderer.render_many(jobs, directory=directory, **kwargs)
+
+
+class AsyncManager(object):
+    """Wraps a manager so every call runs on an executor.
+
+    Method calls return a :class:`concurrent.futures.Future` instead of the
+    result. Sub-managers (e.g. ``orgs.users``) are wrapped as well, so the
+    URL building stays with the regular managers.
+    """
+
+    def __init__(self, manager, executor):
+        self._manager = manager
+        self._executor = executor
+
+    def __getattr__(self, name):
+        from .utils import base
+
+        attr = getattr(self._manager, name)
+        if isinstance(attr, (base.BaseManager, base.FileManager)):
+            return AsyncManager(attr, self._executor)
+        if not callable(attr):
+            return attr
+
+        def submit(*args, **kwargs):
+            return self._executor.submit(attr, *args, **kwargs)
+        return submit
+
+
+class AsyncClient(object):
+
+    """Client for the Grafana v2 API returning futures.
+
+    Takes the same arguments as :class:`Client`, plus:
+
+    :param integer max_workers: Maximum number of requests in flight at once.
+                                (optional, defaults to 8)
+
+    Every manager call, e.g. ``client.dashboards.get(uri)``, returns a
+    :class:`concurrent.futures.Future`. All calls share one pooled session
+    sized to `max_workers`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        from concurrent import futures
+
+        max_workers = kwargs.pop('max_workers', 8)
+        kwargs.setdefault('pool_maxsize', max_workers)
+        self.max_workers = max_workers
+        self.client = Client(*args, **kwargs)
+        self.executor = futures.ThreadPoolExecutor(max_workers)
+        self.orgs = AsyncManager(self.client.orgs, self.executor)
+        self.users = AsyncManager(self.client.users, self.executor)
+        self.dashboards = AsyncManager(self.client.dashboards, self.executor)
+        self.datasources = AsyncManager(self.client.datasources,
+                                        self.executor)
+        self.renderer = AsyncManager(self.client.renderer, self.executor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Wait for pending calls and close the connection pool."""
+        self.executor.shutdown(wait=True)
+        self.client.close()
+
+    def map(self, func, items):
+        """Run `func` over `items` on the client's executor.
+
+        Yields ``(item, result, error)`` tuples as each call finishes.
+        """
+        from .utils import concurrency
+
+        return concurrency.imap_unordered(func, items,
+                                          max_workers=self.max_workers,
+                                          executor=self.executor)
+
+
+class ClientPool(object):
+    """Thread-safe source of org-scoped clients for multi-threaded services.
+
+    Each org gets one thread-safe Client with its own session, created on
+    first request and reused afterwards. Logins are shared through the
+    credential cache, so the pool logs in once per user rather than once
+    per org or per request. Every session sends through a single blocking
+    connection pool, which bounds the connections opened to Grafana in
+    total.
+
+    Takes the same arguments as :class:`Client`, plus:
+
+    :param integer max_connections: Maximum number of connections open to
+                                    Grafana across all orgs. Requests wait
+                                    for a free connection beyond that.
+    """
+
+    def __init__(self, *args, **kwargs):
+        import threading
+
+        self.max_connections = kwargs.pop('max_connections', 10)
+        self._args = args
+        self._kwargs = kwargs
+        self._adapter = None
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def get(self, org_id=None):
+        """Return the client of org `org_id`.
+
+        :param org_id: org the client's requests are scoped to, None for
+                       the user's current org
+        """
+        client = self._clients.get(org_id)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(org_id)
+            if client is None:
+                if self._adapter is None:
+                    from requests.adapters import HTTPAdapter
+
+                    self._adapter = HTTPAdapter(
+                        pool_connections=1,
+                        pool_maxsize=self.max_connections, pool_block=True)
+                kwargs = dict(self._kwargs, org_id=org_id,
+                              adapter=self._adapter, thread_safe=True)
+                client = Client(*self._args, **kwargs)
+                self._clients[org_id] = client
+        return client
+
+    def close(self):
+        """Close every connection of the pool."""
+        with self._lock:
+            if self._adapter is not None:
+                self._adapter.close()
+            self._clients.clear()
@@ -1,4 +1,12 @@
-from twcmanage.lib.grafanaclient.utils import base
+import io
+import os
+
+from six.moves.urllib.parse import urlencode
+from .utils import base
+from .utils import concurrency
+from .utils import jsonpatch
+from .utils import jsonutils
+from . import dashboardstore
 
 
 class Dashboard(base.Resource):
@@ -6,8 +14,9 @@ class Dashboard(base.Resource):
         return '<Dashboard: %s>' % getattr(self, 'title', 'unknown-title')
 
     def update(self, json):
-        """Update dashboard."""
-        return self.manager.update(self.id, json)
+        """Update dashboard, keeping it in its folder."""
+        return self.manager.update(self.id, json,
+                                   **folder_of(self._info))
 
     def delete(self):
         """Delete dashboard."""
@@ -23,12 +32,32 @@ class DashboardJson(base.JsonResource):
         return '<Dashboard: %s>' % getattr(self, 'title', 'unknown-title')
 
     def update(self, json):
-        """Update dashboard."""
-        return self.manager.update(self.id, json)
+        """Update dashboard, keeping it in its folder."""
+        return self.manager.update(self._json['dashboard']['id'], json,
+                                   **folder_of(self._json.get('meta', {})))
+
+    def patch(self, patch, save=True):
+        """Apply a JSON patch (see utils.jsonpatch) to the dashboard.
+
+        Paths are relative to the dashboard, e.g. '/panels/0/title'. The
+        dashboard is only saved when the patch actually changes it.
+
+        :param save: upload the patched dashboard
+        :returns: Grafana's response, or None if nothing was saved
+        """
+        dashboard = self._json['dashboard']
+        patched = jsonpatch.apply(dashboard, patch)
+        # Cheap even for large dashboards: unchanged subtrees are shared.
+        if not jsonpatch.diff(dashboard, patched):
+            return None
+        self._json = dict(self._json, dashboard=patched)
+        self.title = patched['title']
+        if save:
+            return self.update(patched)
 
     def delete(self):
         """Delete dashboard."""
-        return self.manager.delete(self.id)
+        return self.manager.delete('db/%s' % self._json['meta']['slug'])
 
 
 class Tag(base.Resource):
@@ -38,48 +67,253 @@ class Tag(base.Resource):
 
 class DashboardManager(base.BaseManager):
     resource_class = Dashboard
+    cache_namespace = 'dashboards'
 
     def get(self, uri):
         """Get dashboard."""
         return self._get('/api/dashboards/%s' % uri, obj_class=DashboardJson)
 
+    def get_if_changed(self, uri, etag=None):
+        """Get dashboard unless it still matches `etag`.
+
+        :returns: ``(dashboard, etag)`` where dashboard is None when Grafana
+            answered 304 Not Modified
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        resp, body = self.client.json_request(
+            'GET', '/api/dashboards/%s' % uri, headers=headers)
+        if resp.status_code == 304:
+            return None, etag
+        return DashboardJson(self, body), resp.headers.get('ETag')
+
     def list(self):
         """List dashboards."""
         return self._list('/api/search')
 
+    def by_uid(self, uid):
+        """Get dashboard search hit by uid. Raises NotFound if there is none."""
+        # Paged: a plain search returns at most 1000 hits.
+        return self._lookup('uid', uid, items=self.iter_search)
+
+    def by_slug(self, slug):
+        """Get dashboard search hit by slug. Raises NotFound if there is none."""
+        return self._lookup('slug', slug,
+                            key=lambda res: res.uri.split('/')[-1],
+                            items=self.iter_search)
+
     def search(self, **kwargs):
-        """Search dashboards."""
-        url = '/api/search?'
-        for arg in kwargs:
-            url += '%s=%s&' % (arg, kwargs[arg])
-        url = url[:-1]
+        """Search dashboards.
+
+        Keyword arguments are sent as URL-encoded query parameters; list
+        values (e.g. ``tag=['a', 'b']``) are repeated.
+        """
+        url = '/api/search'
+        if kwargs:
+            url += '?' + urlencode(kwargs, doseq=True)
 
         return self._list(url)
 
-    def create(self, dashboard):
-        """Create dashboard."""
-        dashboard['id'] = None
-        json = {'dashboard': dashboard}
+    def iter_search(self, query=None, tags=None, folder_ids=None,
+                    page_size=1000, **kwargs):
+        """Lazily iterate over dashboard search results page by page.
+
+        :param query: search string
+        :param tags: list of tags the dashboards must have
+        :param folder_ids: list of folder ids to search in
+        :param page_size: number of results fetched per request
+        """
+        params = dict(kwargs, query=query, tag=tags, folderIds=folder_ids)
+        return self._iter_pages('/api/search', params, page_size=page_size,
+                                size_param='limit')
+
+    def create(self, dashboard, folder_uid=None, folder_id=None):
+        """Create dashboard, in the General folder unless one is given.
+
+        :param folder_uid: uid of the folder to create the dashboard in
+        :param folder_id: id of that folder, for servers without folder uids
+        """
+        json = {'dashboard': dict(dashboard, id=None)}
+        _set_folder(json, folder_uid, folder_id)
         return self._post('/api/dashboards/db', json=json)
 
-    def update(self, id, dashboard):
-        """Update dashboard."""
-        dashboard['id'] = id
-        json = {'dashboard': dashboard, 'overwrite': True}
+    def update(self, id, dashboard, folder_uid=None, folder_id=None):
+        """Update dashboard.
+
+        Grafana moves a dashboard saved without a folder to the General
+        folder; pass the folder it is in (see folder_of) to keep it there.
+
+        :param folder_uid: uid of the folder to save the dashboard in
+        :param folder_id: id of that folder, for servers without folder uids
+        """
+        json = {'dashboard': dict(dashboard, id=id), 'overwrite': True}
+        _set_folder(json, folder_uid, folder_id)
         return self._post('/api/dashboards/db', json=json)
 
     def _import(self, dashboard):
         """Import dashboard."""
-        dashboard['id'] = None
-        json = {'dashboard': dashboard, 'overwrite': True}
+        json = {'dashboard': dict(dashboard, id=None), 'overwrite': True}
         return self._post('/api/dashboards/import', json=json)
 
     def delete(self, uri):
         """Delete dashboard."""
         return self._delete('/api/dashboards/%s' % uri)
 
+    def export_all(self, directory=None, max_workers=8, progress=None,
+                   checkpoint=None):
+        """Fetch every dashboard concurrently.
+
+        :param directory: if given, each dashboard is written to
+            ``<directory>/<uid>.json`` (``<slug>.json`` for dashboards
+            without a uid) and the result is the file path, otherwise the
+            result is the dashboard JSON
+        :param max_workers: maximum number of concurrent requests
+        :param progress: callable invoked as ``progress(done, failed)``
+        :param checkpoint: path of a checkpoint file; dashboards already
+            recorded in it are skipped so an interrupted export can resume
+        :returns: BatchResult keyed by dashboard uri
+        """
+        if checkpoint is not None:
+            checkpoint = concurrency.Checkpoint(checkpoint)
+
+        def export(hit):
+            dashboard = self.get(hit.uri)._json
+            if directory is None:
+                return dashboard
+            # Slugs are only unique within a folder; uids are unique.
+            name = getattr(hit, 'uid', None) or hit.uri.split('/')[-1]
+            path = os.path.join(directory, '%s.json' % name)
+            with io.open(path, 'w', encoding='utf-8') as f:
+                f.write(jsonutils.dumps(dashboard))
+            return path
+
+        # Paged: a plain search returns at most 1000 hits.
+        hits = (d for d in self.iter_search()
+                if getattr(d, 'type', None) != 'dash-folder')
+        return concurrency.run_batch(export, hits, key=lambda hit: hit.uri,
+                                     max_workers=max_workers,
+                                     progress=progress, checkpoint=checkpoint)
+
+    def import_many(self, dashboards, max_workers=8, progress=None,
+                    checkpoint=None):
+        """Import many dashboards concurrently.
+
+        :param dashboards: iterable of dashboard JSON documents, either the
+            dashboard itself or the ``{'dashboard': ..., 'meta': ...}``
+            document returned by get/export_all
+        :param max_workers: maximum number of concurrent requests
+        :param progress: callable invoked as ``progress(done, failed)``
+        :param checkpoint: path of a checkpoint file; dashboards already
+            recorded in it are skipped so an interrupted import can resume
+        :returns: BatchResult keyed by dashboard uid (or title)
+        """
+        if checkpoint is not None:
+            checkpoint = concurrency.Checkpoint(checkpoint)
+
+        def unwrap(doc):
+            return doc.get('dashboard', doc)
+
+        def key(doc):
+            dashboard = unwrap(doc)
+            return dashboard.get('uid') or dashboard['title']
+
+        return concurrency.run_batch(lambda doc: self._import(unwrap(doc)),
+                                     dashboards, key=key,
+                                     max_workers=max_workers,
+                                     progress=progress, checkpoint=checkpoint)
+
+    def transform(self, patch, uris=None, max_workers=8, progress=None,
+                  checkpoint=None):
+        """Apply the same change to many dashboards concurrently.
+
+        Dashboards the change leaves as they are are not written.
+
+        :param patch: JSON patch applied to every dashboard, or a callable
+            returning the patch for a dashboard document (see
+            datasource_rename)
+        :param uris: uris of the dashboards to change (defaults to all)
+        :param max_workers: maximum number of concurrent requests
+        :param progress: callable invoked as ``progress(done, failed)``
+        :param checkpoint: path of a checkpoint file; dashboards already
+            recorded in it are skipped so an interrupted run can resume
+        :returns: BatchResult keyed by dashboard uri, with None as result
+            for unchanged dashboards
+        """
+        if checkpoint is not None:
+            checkpoint = concurrency.Checkpoint(checkpoint)
+
+        def transform(uri):
+            dashboard = self.get(uri)
+            ops = patch
+            if callable(patch):
+                ops = patch(dashboard._json['dashboard'])
+            return dashboard.patch(ops)
+
+        if uris is None:
+            # Paged: a plain search returns at most 1000 hits.
+            uris = (d.uri for d in self.iter_search()
+                    if getattr(d, 'type', None) != 'dash-folder')
+        return concurrency.run_batch(transform, uris, max_workers=max_workers,
+                                     progress=progress, checkpoint=checkpoint)
+
+    def store(self, directory, max_workers=8):
+        """Return a DashboardStore mirroring this org into `directory`."""
+        return dashboardstore.DashboardStore(self, directory,
+                                             max_workers=max_workers)
+
     def get_home(self):
         return self._get('/api/dashboards/home')
 
     def list_tags(self):
         return self._list('/api/dashboards/tags', obj_class=Tag)
+
+
+def folder_of(meta):
+    """Return DashboardManager.update arguments for the folder of `meta`.
+
+    `meta` is the ``meta`` of a fetched dashboard or a search hit; servers
+    that predate folder uids only report the folder id.
+    """
+    if meta.get('folderUid') is not None:
+        return {'folder_uid': meta['folderUid']}
+    if meta.get('folderId') is not None:
+        return {'folder_id': meta['folderId']}
+    return {}
+
+
+def _set_folder(json, folder_uid, folder_id):
+    if folder_uid is not None:
+        json['folderUid'] = folder_uid
+    elif folder_id is not None:
+        json['folderId'] = folder_id
+
+
+def datasource_rename(old, new):
+    """Patch factory for DashboardManager.transform renaming a datasource.
+
+    Every ``datasource`` field equal to `old` (a name, or a reference such
+    as ``{'type': ..., 'uid': ...}``) is replaced with `new`.
+    """
+    def patch(dashboard):
+        return [{'op': 'replace', 'path': path, 'value': new}
+                for path in _find_fields(dashboard, 'datasource', old)]
+    return patch
+
+
+def _find_fields(node, name, value):
+    """Return the JSON pointers of the `name` fields equal to `value`."""
+    found = []
+    stack = [(node, ())]
+    while stack:
+        node, tokens = stack.pop()
+        if isinstance(node, dict):
+            items = node.items()
+        else:
+            items = enumerate(node)
+        for k, v in items:
+            if k == name and v == value:
+                found.append(jsonpatch.make_pointer(tokens + (k,)))
+            elif isinstance(v, (dict, list)):
+                stack.append((v, tokens + (k,)))
+    return found
@@ -0,0 +1,155 @@
+import io
+import os
+
+from .utils import concurrency
+from .utils import jsonutils
+
+
+class RefreshResult(object):
+    """Keys of the dashboards touched by DashboardStore.refresh."""
+
+    def __init__(self):
+        self.added = []
+        self.updated = []
+        self.removed = []
+        self.unchanged = []
+        self.errors = {}
+
+    def __repr__(self):
+        return ('<RefreshResult: %d added, %d updated, %d removed, '
+                '%d unchanged, %d failed>' % (
+                    len(self.added), len(self.updated), len(self.removed),
+                    len(self.unchanged), len(self.errors)))
+
+
+class DashboardStore(object):
+    """Local mirror of the dashboards of an org.
+
+    Each dashboard is kept as ``<directory>/<key>.json`` where the key is
+    its uid (or its uri for Grafana versions without uids). An index file
+    records the version, update time and ETag of every stored dashboard.
+
+    :param manager: DashboardManager of the org to mirror
+    :param directory: directory the mirror is kept in
+    :param max_workers: maximum number of concurrent fetches on refresh
+    """
+
+    index_name = 'index.json'
+
+    def __init__(self, manager, directory, max_workers=8):
+        self.manager = manager
+        self.directory = directory
+        self.max_workers = max_workers
+        self.index = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, self.index_name)
+        if os.path.exists(path):
+            with io.open(path, encoding='utf-8') as f:
+                self.index = jsonutils.loads(f.read())
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        return list(self.index)
+
+    def get(self, key):
+        """Return the stored dashboard document for `key`."""
+        with io.open(self._path(key), encoding='utf-8') as f:
+            return jsonutils.loads(f.read())
+
+    def refresh(self):
+        """Bring the mirror up to date with one paged search.
+
+        Dashboards whose search hit carries a version equal to the stored
+        one are skipped outright. The others are fetched concurrently with
+        If-None-Match when an ETag is known, and are only rewritten when
+        their version or update time changed. Dashboards no longer listed
+        are removed.
+
+        :returns: RefreshResult
+        """
+        result = RefreshResult()
+        hits = {}
+        # Paged: a plain search returns at most 1000 hits.
+        for hit in self.manager.iter_search():
+            if getattr(hit, 'type', None) == 'dash-folder':
+                continue
+            hits[getattr(hit, 'uid', None) or hit.uri] = hit
+
+        def stale():
+            for key, hit in hits.items():
+                known = self.index.get(key)
+                version = getattr(hit, 'version', None)
+                if known and version is not None and \
+                        known['version'] == version:
+                    result.unchanged.append(key)
+                    continue
+                yield key
+
+        def fetch(key):
+            known = self.index.get(key) or {}
+            return self.manager.get_if_changed(hits[key].uri,
+                                               known.get('etag'))
+
+        for key, fetched, error in concurrency.imap_unordered(
+                fetch, stale(), self.max_workers):
+            if error is not None:
+                result.errors[key] = error
+                continue
+            dashboard, etag = fetched
+            known = self.index.get(key)
+            if dashboard is None:
+                result.unchanged.append(key)
+                continue
+            entry = self._entry(hits[key].uri, dashboard._json, etag)
+            if known and (known['version'], known['updated']) == \
+                    (entry['version'], entry['updated']):
+                known['etag'] = etag
+                result.unchanged.append(key)
+                continue
+            self._write(key, dashboard._json)
+            self.index[key] = entry
+            if known:
+                result.updated.append(key)
+            else:
+                result.added.append(key)
+
+        for key in [k for k in self.index if k not in hits]:
+            os.remove(self._path(key))
+            del self.index[key]
+            result.removed.append(key)
+
+        self._save_index()
+        return result
+
+    @staticmethod
+    def _entry(uri, document, etag):
+        meta = document.get('meta', {})
+        return {'uri': uri,
+                'version': meta.get('version',
+                                    document['dashboard'].get('version')),
+                'updated': meta.get('updated'),
+                'etag': etag}
+
+    def _path(self, key):
+        return os.path.join(self.directory,
+                            '%s.json' % key.replace('/', '_'))
+
+    def _write(self, key, document):
+        self._atomic_write(self._path(key), jsonutils.dumps(document))
+
+    def _save_index(self):
+        self._atomic_write(os.path.join(self.directory, self.index_name),
+                           jsonutils.dumps(self.index))
+
+    @staticmethod
+    def _atomic_write(path, data):
+        tmp = path + '.tmp'
+        with io.open(tmp, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.rename(tmp, path)
@@ -1,4 +1,35 @@
-from twcmanage.lib.grafanaclient.utils import base
+import time
+
+from .utils import base
+from .utils import concurrency
+from .utils import exceptions
+
+
+class HealthResult(object):
+    """Outcome of a datasource health probe.
+
+    `status` is Grafana's verdict ('OK' or 'ERROR'), or 'ERROR' when the
+    probe itself failed, in which case `error` holds the exception.
+    `latency` is the duration of the probe in seconds.
+    """
+
+    def __init__(self, datasource, status, message, latency, error=None,
+                 org_id=None):
+        self.datasource = datasource
+        self.status = status
+        self.message = message
+        self.latency = latency
+        self.error = error
+        self.org_id = org_id
+
+    def __repr__(self):
+        return '<HealthResult: %s %s %.3fs>' % (
+            getattr(self.datasource, 'name', 'unknown-name'), self.status,
+            self.latency)
+
+    @property
+    def ok(self):
+        return self.status == 'OK'
 
 
 class Datasource(base.Resource):
@@ -13,9 +44,14 @@ class Datasource(base.Resource):
         """Delete datasource."""
         return self.manager.delete(self.id)
 
+    def check_health(self, timeout=10):
+        """Probe the datasource's backend, see DatasourceManager."""
+        return self.manager.check_health(self, timeout=timeout)
+
 
 class DatasourceManager(base.BaseManager):
     resource_class = Datasource
+    cache_namespace = 'datasources'
 
     def list(self):
         """List datasources."""
@@ -25,6 +61,19 @@ class DatasourceManager(base.BaseManager):
         """Get datasource."""
         return self._get('/api/datasources/%s' % id)
 
+    def by_name(self, name):
+        """Get datasource by name. Raises NotFound if there is none."""
+        return self._lookup('name', name)
+
+    def batched_get(self, id):
+        """Get datasource, batching concurrent lookups into one list call.
+
+        Returns the entry from the list call, or from a single GET when the
+        list (which Grafana may page) does not include it; raises NotFound
+        if there is none.
+        """
+        return self._batched_get(id)
+
     def create(self, json):
         """Create datasource."""
         return self._post('/api/datasources', json=json)
@@ -36,3 +85,76 @@ class DatasourceManager(base.BaseManager):
     def delete(self, id):
         """Delete datasource."""
         return self._delete('/api/datasources/%s' % id)
+
+    def check_health(self, datasource, timeout=10):
+        """Ask Grafana to test the connection of `datasource`.
+
+        The probe is never retried or cached, and failures are reported in
+        the result rather than raised.
+
+        :param datasource: Datasource to probe
+        :param timeout: HTTP timeout of the probe in seconds
+        :returns: HealthResult
+        """
+        uid = getattr(datasource, 'uid', None)
+        if uid:
+            url = '/api/datasources/uid/%s/health' % uid
+        else:
+            url = '/api/datasources/%s/health' % datasource.id
+        start = time.time()
+        try:
+            resp, body = self.client.json_request('GET', url, timeout=timeout,
+                                                  retry=False)
+        except exceptions.HTTPException as e:
+            # Grafana answers failed checks with an error status and body.
+            return HealthResult(datasource, e.details.get('status', 'ERROR'),
+                                e.details.get('message'),
+                                time.time() - start, error=e,
+                                org_id=self.client.org_id)
+        except exceptions.GrafanaException as e:
+            return HealthResult(datasource, 'ERROR', str(e),
+                                time.time() - start, error=e,
+                                org_id=self.client.org_id)
+        body = body or {}
+        return HealthResult(datasource, body.get('status', 'OK'),
+                            body.get('message'), time.time() - start,
+                            org_id=self.client.org_id)
+
+    def check_all(self, datasources=None, orgs=None, timeout=10,
+                  max_workers=16):
+        """Probe many datasources concurrently.
+
+        Results are yielded as probes finish, so a slow or dead backend
+        only delays its own result.
+
+        :param datasources: Datasources to probe (defaults to all of them)
+        :param orgs: ids of the orgs whose datasources are probed, instead
+            of this manager's org; ignored when `datasources` is given
+        :param timeout: HTTP timeout of each probe in seconds
+        :param max_workers: maximum number of probes in flight
+        :returns: generator of HealthResult
+        """
+        if datasources is not None:
+            probes = ((self, ds) for ds in datasources)
+        elif orgs is not None:
+            probes = self._org_probes(orgs)
+        else:
+            probes = ((self, ds) for ds in self.list())
+
+        def probe(item):
+            manager, datasource = item
+            return manager.check_health(datasource, timeout=timeout)
+
+        for (manager, datasource), result, error in \
+                concurrency.imap_unordered(probe, probes, max_workers):
+            if error is not None:
+                result = HealthResult(datasource, 'ERROR', str(error), 0.0,
+                                      error=error,
+                                      org_id=manager.client.org_id)
+            yield result
+
+    def _org_probes(self, orgs):
+        for org_id in orgs:
+            manager = DatasourceManager(self.client.scoped(org_id))
+            for datasource in manager.list():
+                yield manager, datasource
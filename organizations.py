@@ -1,5 +1,5 @@
-from twcmanage.lib.grafanaclient.utils import base
-import orgusers
+from .utils import base
+from . import orgusers
 
 
 class Organization(base.Resource):
@@ -27,6 +27,8 @@ class Organization(base.Resource):
 
 class OrganizationManager(base.BaseManager):
     resource_class = Organization
+    cache_namespace = 'orgs'
+    org_scoped = False
 
     def __init__(self, client):
         super(OrganizationManager, self).__init__(client)
@@ -43,6 +45,10 @@ class OrganizationManager(base.BaseManager):
         """List all orgs."""
         return self._list('/api/orgs')
 
+    def by_name(self, name):
+        """Get org by name. Raises NotFound if there is none."""
+        return self._lookup('name', name)
+
     def create(self, name, address=None):
         """Create org."""
         data = {
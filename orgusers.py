@@ -1,4 +1,4 @@
-from twcmanage.lib.grafanaclient.utils import base
+from .utils import base
 
 
 class OrgUser(base.Resource):
@@ -14,6 +14,7 @@ class OrgUser(base.Resource):
 
 class OrgUserManager(base.BaseManager):
     resource_class = OrgUser
+    cache_namespace = 'orgusers'
 
     def list(self, orgid=None):
         """List users in org."""
@@ -22,6 +23,19 @@ class OrgUserManager(base.BaseManager):
         else:
             return self._list("/api/org/users")
 
+    def iter_org_users(self, orgid=None, query=None, page_size=1000):
+        """Lazily iterate over users in org page by page.
+
+        :param query: only users whose login, email or name match
+        :param page_size: number of users fetched per request
+        """
+        if orgid:
+            url = "/api/orgs/%s/users/search" % orgid
+        else:
+            url = "/api/org/users/search"
+        return self._iter_pages(url, {'query': query}, items_key='orgUsers',
+                                page_size=page_size)
+
     def add(self, role, login, orgid=None):
         """Add a user to the org."""
         data = {
@@ -0,0 +1,339 @@
+"""
+Declarative desired-state reconciliation.
+
+The desired state maps org names to what the org should contain::
+
+    {
+        'Main Org.': {
+            'datasources': [{'name': 'prometheus', 'type': 'prometheus',
+                             'url': 'http://prometheus:9090',
+                             'access': 'proxy'}],
+            'dashboards': [{'uid': 'nodes', 'title': 'Nodes', ...}],
+            'users': {'alice': 'Editor', 'bob': 'Viewer'},
+        },
+    }
+
+Reconciler.plan fetches the current state of those orgs concurrently and
+returns only the changes needed; Reconciler.apply issues them in parallel.
+
+Dashboards are matched by uid, or by title when the desired dashboard has
+none. Titles are only unique within a folder, so a desired dashboard may
+name its folder with ``folderUid`` (``''`` for General), or ``folderId`` on
+servers without folder uids; a title matching dashboards in several
+folders is an error. The folder is also where dashboards are created and
+moved to; updates of dashboards without one keep them where they are.
+Write-only datasource fields (passwords, ``secureJsonData``) are
+never returned by Grafana and so are not compared: they are sent when a
+datasource is created or updated for another reason.
+"""
+
+from __future__ import print_function
+
+import sys
+
+from . import dashboards
+from .utils import concurrency
+
+# Fields Grafana manages itself and which never count as a difference.
+DASHBOARD_IGNORED_FIELDS = ('id', 'version')
+
+# Fields of a desired dashboard naming its folder rather than its content.
+DASHBOARD_FOLDER_FIELDS = ('folderUid', 'folderId')
+
+# Datasource fields Grafana accepts but never returns.
+DATASOURCE_WRITE_ONLY_FIELDS = ('password', 'basicAuthPassword',
+                                'secureJsonData')
+
+
+class Change(object):
+    """A single write needed to reach the desired state.
+
+    :param action: 'create', 'update' or 'delete'
+    :param kind: 'org', 'datasource', 'dashboard' or 'user'
+    :param org: name of the org the change applies to
+    :param key: name, uid/title or login identifying the object
+    :param desired: desired object (None for deletes)
+    :param current: current object (None for creates)
+    :param fields: names of the fields that differ (updates only)
+    """
+
+    def __init__(self, action, kind, org, key, desired=None, current=None,
+                 fields=None):
+        self.action = action
+        self.kind = kind
+        self.org = org
+        self.key = key
+        self.desired = desired
+        self.current = current
+        self.fields = fields or []
+
+    def __repr__(self):
+        return '<Change: %s>' % self
+
+    def __str__(self):
+        text = '%s %s %r' % (self.action, self.kind, self.key)
+        if self.kind != 'org':
+            text += ' in org %r' % self.org
+        if self.fields:
+            text += ' (%s)' % ', '.join(sorted(self.fields))
+        return text
+
+
+def changed_fields(desired, current, ignored=()):
+    """Top-level fields of `desired` whose value differs in `current`.
+
+    Fields only present in `current` are not compared, so server-side
+    defaults do not show up as differences.
+    """
+    return [k for k, v in desired.items()
+            if k not in ignored and current.get(k) != v]
+
+
+def _match_title(org, dashboard, hits):
+    """Return the search hit of `hits` (all titled like `dashboard`) that
+    `dashboard` refers to, or None.
+
+    Raises ValueError if it could be any of several.
+    """
+    if 'folderUid' in dashboard:
+        hits = [hit for hit in hits
+                if (getattr(hit, 'folderUid', None) or '') ==
+                dashboard['folderUid']]
+    elif 'folderId' in dashboard:
+        hits = [hit for hit in hits
+                if getattr(hit, 'folderId', 0) == dashboard['folderId']]
+    if len(hits) > 1:
+        raise ValueError('%d dashboards in org %r are titled %r; give a uid '
+                         'or folder to pick one' %
+                         (len(hits), org, dashboard['title']))
+    return hits[0] if hits else None
+
+
+class Reconciler(object):
+    """Computes and applies minimal changes towards a desired state.
+
+    :param client: Client to reconcile
+    :param prune: also delete datasources, dashboards and org users that
+        are not in the desired state of their org
+    :param max_workers: maximum number of concurrent requests
+    """
+
+    def __init__(self, client, prune=False, max_workers=8):
+        self.client = client
+        self.prune = prune
+        self.max_workers = max_workers
+
+    def plan(self, desired):
+        """Return the list of Changes needed to reach `desired`."""
+        orgs = dict((org.name, org) for org in self.client.orgs.list())
+        changes = [Change('create', 'org', name, name, desired={'name': name})
+                   for name in desired if name not in orgs]
+
+        def plan_org(name):
+            org = orgs.get(name)
+            scoped = self.client.scoped(org.id) if org else None
+            state = desired[name]
+            return (self._plan_datasources(name, scoped,
+                                           state.get('datasources')) +
+                    self._plan_dashboards(name, scoped,
+                                          state.get('dashboards')) +
+                    self._plan_users(name, scoped, org, state.get('users')))
+
+        for name, org_changes, error in concurrency.imap_unordered(
+                plan_org, list(desired), self.max_workers):
+            if error is not None:
+                raise error
+            changes.extend(org_changes)
+        return changes
+
+    def apply(self, changes):
+        """Issue `changes` (as returned by plan).
+
+        Orgs are created first; everything else runs in parallel.
+
+        :returns: BatchResult keyed by the description of each change
+        """
+        org_changes = [c for c in changes if c.kind == 'org']
+        other_changes = [c for c in changes if c.kind != 'org']
+        result = concurrency.run_batch(self._apply, org_changes, key=str,
+                                       max_workers=self.max_workers)
+        orgs = dict((org.name, org.id) for org in self.client.orgs.list())
+
+        def apply_scoped(change):
+            return self._apply(change, self.client.scoped(orgs[change.org]))
+
+        scoped = concurrency.run_batch(apply_scoped, other_changes, key=str,
+                                       max_workers=self.max_workers)
+        result.results.update(scoped.results)
+        result.errors.update(scoped.errors)
+        return result
+
+    def reconcile(self, desired, dry_run=False, out=None):
+        """Plan and (unless `dry_run`) apply the changes.
+
+        The plan is printed to `out` (stdout by default) in dry-run mode.
+
+        :returns: the plan in dry-run mode, otherwise the BatchResult
+        """
+        changes = self.plan(desired)
+        if dry_run:
+            out = out or sys.stdout
+            for change in changes:
+                print(change, file=out)
+            if not changes:
+                print('No changes.', file=out)
+            return changes
+        return self.apply(changes)
+
+    def _plan_datasources(self, org, client, desired):
+        if desired is None:
+            return []
+        current = {}
+        if client is not None:
+            current = dict((ds.name, ds.to_dict())
+                           for ds in client.datasources.list())
+        changes = []
+        for ds in desired:
+            existing = current.pop(ds['name'], None)
+            if existing is None:
+                changes.append(Change('create', 'datasource', org,
+                                      ds['name'], desired=ds))
+                continue
+            fields = changed_fields(ds, existing,
+                                    DATASOURCE_WRITE_ONLY_FIELDS)
+            if fields:
+                changes.append(Change('update', 'datasource', org,
+                                      ds['name'], desired=ds,
+                                      current=existing, fields=fields))
+        if self.prune:
+            changes.extend(Change('delete', 'datasource', org, name,
+                                  current=ds)
+                           for name, ds in current.items())
+        return changes
+
+    def _plan_dashboards(self, org, client, desired):
+        if desired is None:
+            return []
+
+        def key(dashboard):
+            return dashboard.get('uid') or dashboard['title']
+
+        hits = []
+        if client is not None:
+            # Paged: a plain search returns at most 1000 hits.
+            hits = [hit for hit in client.dashboards.iter_search()
+                    if getattr(hit, 'type', None) != 'dash-folder']
+        by_uid = dict((hit.uid, hit) for hit in hits
+                      if getattr(hit, 'uid', None))
+        by_title = {}
+        for hit in hits:
+            by_title.setdefault(hit.title, []).append(hit)
+        wanted = dict((key(d), d) for d in desired)
+        matched = {}
+        for k, dashboard in wanted.items():
+            if dashboard.get('uid'):
+                hit = by_uid.get(dashboard['uid'])
+            else:
+                hit = _match_title(org, dashboard,
+                                   by_title.get(dashboard['title'], []))
+            if hit is not None:
+                matched[k] = hit
+        existing = list(matched)
+
+        def fetch(k):
+            return client.dashboards.get(matched[k].uri)._json
+
+        current = {}
+        for k, dashboard, error in concurrency.imap_unordered(
+                fetch, existing, self.max_workers):
+            if error is not None:
+                raise error
+            current[k] = dashboard
+
+        changes = []
+        for k, dashboard in wanted.items():
+            if k not in current:
+                changes.append(Change('create', 'dashboard', org, k,
+                                      desired=dashboard))
+                continue
+            body = current[k]['dashboard']
+            meta = current[k].get('meta', {})
+            fields = changed_fields(
+                dashboard, body,
+                DASHBOARD_IGNORED_FIELDS + DASHBOARD_FOLDER_FIELDS)
+            fields.extend(f for f in DASHBOARD_FOLDER_FIELDS
+                          if f in dashboard and meta.get(f) != dashboard[f])
+            if not fields:
+                continue
+            if not any(f in dashboard for f in DASHBOARD_FOLDER_FIELDS):
+                # Saved without a folder, it would move to General.
+                dashboard = dict(dashboard, **dict(
+                    (f, meta[f]) for f in DASHBOARD_FOLDER_FIELDS
+                    if f in meta))
+            changes.append(Change('update', 'dashboard', org, k,
+                                  desired=dashboard, current=body,
+                                  fields=fields))
+        if self.prune:
+            kept = set(hit.uri for hit in matched.values())
+            changes.extend(Change('delete', 'dashboard', org,
+                                  getattr(hit, 'uid', None) or hit.title,
+                                  current={'uri': hit.uri})
+                           for hit in hits if hit.uri not in kept)
+        return changes
+
+    def _plan_users(self, org, client, org_resource, desired):
+        if desired is None:
+            return []
+        current = {}
+        if client is not None:
+            current = dict((user.login, user.to_dict()) for user in
+                           client.orgs.users.list(org_resource.id))
+        changes = []
+        for login, role in desired.items():
+            user = current.pop(login, None)
+            if user is None:
+                changes.append(Change('create', 'user', org, login,
+                                      desired={'role': role}))
+            elif user['role'] != role:
+                changes.append(Change('update', 'user', org, login,
+                                      desired={'role': role}, current=user,
+                                      fields=['role']))
+        if self.prune:
+            changes.extend(Change('delete', 'user', org, login, current=user)
+                           for login, user in current.items())
+        return changes
+
+    def _apply(self, change, client=None):
+        client = client or self.client
+        if change.kind == 'org':
+            return client.orgs.create(change.key)
+        if change.kind == 'datasource':
+            if change.action == 'create':
+                return client.datasources.create(change.desired)
+            if change.action == 'update':
+                body = dict(change.current, **change.desired)
+                return client.datasources.update(change.current['id'], body)
+            return client.datasources.delete(change.current['id'])
+        if change.kind == 'dashboard':
+            if change.action == 'delete':
+                return client.dashboards.delete(change.current['uri'])
+            body = dict(change.desired)
+            folder = dashboards.folder_of(dict(
+                (f, body.pop(f)) for f in DASHBOARD_FOLDER_FIELDS
+                if f in body))
+            if change.action == 'create':
+                return client.dashboards.create(body, **folder)
+            return client.dashboards.update(change.current['id'], body,
+                                            **folder)
+        if change.kind == 'user':
+            orgid = client.http_client.org_id
+            if change.action == 'create':
+                return client.orgs.users.add(change.desired['role'],
+                                             change.key, orgid=orgid)
+            if change.action == 'update':
+                return client.orgs.users.update(change.desired['role'],
+                                                change.current['userId'],
+                                                orgid=orgid)
+            return client.orgs.users.remove(change.current['userId'],
+                                            orgid=orgid)
+        raise ValueError('Unknown change kind: %s' % change.kind)
@@ -1,13 +1,169 @@
-import urllib
-from twcmanage.lib.grafanaclient.utils import base
+import io
+import os
+import threading
+import time
+
+from six.moves.urllib.parse import urlencode
+from .utils import base
+from .utils import concurrency
+from .utils import jsonutils
+
+# Extra seconds the HTTP read timeout allows on top of the render timeout
+# Grafana is asked to honor, so Grafana reports its own timeout first.
+RENDER_TIMEOUT_MARGIN = 5
+
+
+class RenderResult(object):
+    """A panel render written to `output`."""
+
+    def __init__(self, output, size, elapsed):
+        self.output = output
+        self.size = size
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return '<RenderResult: %s %d bytes in %.2fs>' % (
+            self.output, self.size, self.elapsed)
 
 
 class Renderer(base.FileManager):
-    def render(self, slug, from_time, to_time, panel, **kwargs):
-        """Render panel image."""
+    def __init__(self, client):
+        super(Renderer, self).__init__(client)
+        self._lock = threading.Lock()
+        self.renders = 0
+        self.bytes_total = 0
+        self.seconds_total = 0.0
+
+    def render(self, slug, from_time, to_time, panel, output=None, width=None,
+               height=None, theme=None, timeout=None, chunk_size=64 * 1024,
+               retry=None, **kwargs):
+        """Render panel image.
+
+        Without `output` the raw response is returned. With `output` (a path
+        or writable binary file-like object) the image is streamed to it in
+        `chunk_size` pieces and a RenderResult is returned.
+
+        :param timeout: render timeout in seconds, sent to Grafana and used
+            for the HTTP request
+        :param retry: per-request retry override, False to send the render
+            request only once
+        """
         path = "/render/dashboard-solo/db/%s?" % slug
         params = {'to': to_time, 'from': from_time, 'panelId': panel}
+        for key, value in (('width', width), ('height', height),
+                           ('theme', theme), ('timeout', timeout)):
+            if value is not None:
+                params[key] = value
         for key in kwargs:
             params[key] = kwargs[key]
-        path += urllib.urlencode(params)
-        return self._get(path)
+        path += urlencode(params)
+
+        http_timeout = None
+        if timeout is not None:
+            http_timeout = timeout + RENDER_TIMEOUT_MARGIN
+        if output is None:
+            if http_timeout is None and retry is None:
+                return self._get(path)
+            request = {'timeout': http_timeout}
+            if retry is not None:
+                request['retry'] = retry
+            return self.client.raw_get(path, **request)
+
+        start = time.time()
+        size = self._download(path, output, chunk_size=chunk_size,
+                              timeout=http_timeout, retry=retry)
+        elapsed = time.time() - start
+        with self._lock:
+            self.renders += 1
+            self.bytes_total += size
+            self.seconds_total += elapsed
+        return RenderResult(output, size, elapsed)
+
+    def render_many(self, jobs, directory='.', max_workers=4, timeout=60,
+                    retries=2, retry_delay=1, manifest=None, job_timeout=None,
+                    **kwargs):
+        """Render many panels concurrently.
+
+        Each job is a ``(slug, panel, from_time, to_time)`` tuple with times
+        in epoch milliseconds, optionally followed by an output file name.
+        Panels are written to ``<directory>/<slug>-<panel>.png`` by default;
+        failed or timed-out renders are retried up to `retries` times. The
+        render requests themselves are never retried by the client's retry
+        policy, so `retries` is the only source of retries.
+
+        :param max_workers: maximum number of renders in flight
+        :param timeout: per-render timeout in seconds
+        :param job_timeout: seconds a job may take over all its attempts;
+            no attempt is started, and no render timeout reaches, past it
+            (defaults to enough for every attempt)
+        :param manifest: optional path the manifest is written to as JSON
+        :returns: manifest, a list of dicts with the job, output file, size,
+            elapsed time, attempts and error (if any) of every render
+        """
+        job_seconds = job_timeout
+        if job_seconds is None:
+            job_seconds = ((retries + 1) * (timeout + RENDER_TIMEOUT_MARGIN) +
+                           retry_delay * retries * (retries + 1) / 2.0)
+
+        def render_job(job):
+            slug, panel, from_time, to_time = job[:4]
+            if len(job) > 4:
+                filename = job[4]
+            else:
+                filename = '%s-%s.png' % (slug, panel)
+            output = os.path.join(directory, filename)
+            entry = {'slug': slug, 'panel': panel, 'from': from_time,
+                     'to': to_time, 'output': output, 'size': None,
+                     'elapsed': None, 'attempts': 0, 'error': None}
+            deadline = time.time() + job_seconds
+            while True:
+                # Leave Grafana's render timeout room for the HTTP margin.
+                remaining = deadline - time.time() - RENDER_TIMEOUT_MARGIN
+                if remaining < 1:
+                    entry['error'] = entry['error'] or 'Job timed out'
+                    return entry
+                entry['attempts'] += 1
+                try:
+                    result = self.render(slug, from_time, to_time, panel,
+                                         output=output,
+                                         timeout=min(timeout,
+                                                     int(remaining)),
+                                         retry=False, **kwargs)
+                except Exception as e:
+                    entry['error'] = str(e)
+                    delay = retry_delay * entry['attempts']
+                    if entry['attempts'] > retries or \
+                            time.time() + delay >= deadline:
+                        return entry
+                    time.sleep(delay)
+                    continue
+                entry['error'] = None
+                entry['size'] = result.size
+                entry['elapsed'] = result.elapsed
+                return entry
+
+        entries = [entry for job, entry, error in
+                   concurrency.imap_unordered(render_job, jobs, max_workers)]
+        if manifest is not None:
+            with io.open(manifest, 'w', encoding='utf-8') as f:
+                f.write(jsonutils.dumps(entries))
+        return entries
+
+
+def panel_ids(dashboard):
+    """Return the ids of every renderable panel of a dashboard JSON.
+
+    Handles both the legacy ``rows`` layout and the flat ``panels`` layout
+    with (collapsed) row panels.
+    """
+    panels = list(dashboard.get('panels', []))
+    for row in dashboard.get('rows', []):
+        panels.extend(row.get('panels', []))
+    ids = []
+    while panels:
+        panel = panels.pop(0)
+        if panel.get('type') == 'row':
+            panels.extend(panel.get('panels', []))
+        elif 'id' in panel:
+            ids.append(panel['id'])
+    return ids
@@ -0,0 +1,343 @@
+"""
+Offline snapshot and restore of a whole Grafana instance.
+
+A snapshot is a deflate-compressed zip archive::
+
+    manifest.json        format version, creation time and record counts
+    orgs.jsonl           one org per line
+    users.jsonl          one user per line
+    memberships.jsonl    {"org": name, "login": ..., "role": ...}
+    datasources.jsonl    {"org": name, "datasource": {...}}
+    dashboards.jsonl     {"org": name, "uid": ..., "title": ..., "blob": sha}
+    blobs/<sha>.json     dashboard JSON, stored once per distinct content
+
+Dashboards are stored content-addressed: their JSON, without the
+instance-specific id and version, is encoded with sorted keys and named
+after its SHA-256, so a dashboard copied into many orgs takes the space of
+one. Records are streamed in and out of the archive, so neither taking nor
+restoring a snapshot holds more than a bounded number of objects in
+memory.
+
+Restore matches orgs, users and datasources by name and is idempotent:
+existing objects are updated instead of duplicated. Grafana never returns
+passwords, so restored users get a new password (random unless given) and
+dashboards are restored into the General folder.
+"""
+
+import binascii
+import hashlib
+import io
+import os
+import tempfile
+import time
+import zipfile
+
+import six
+
+from .utils import concurrency
+from .utils import exceptions
+from .utils import jsonutils
+
+FORMAT_VERSION = 1
+
+# Restore order; each stage only depends on the ones before it.
+STAGES = ('orgs', 'users', 'memberships', 'datasources', 'dashboards')
+
+# Fields Grafana assigns per instance and which are left out of blobs.
+DASHBOARD_VOLATILE_FIELDS = ('id', 'version')
+
+# Statuses Grafana answers with when the object already exists.
+CONFLICT_STATUSES = (409, 412)
+
+
+def _encode(record, sort_keys=False):
+    data = jsonutils.dumps(record, sort_keys=sort_keys)
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+    return data
+
+
+def _conflict(error):
+    return getattr(error, 'status_code', None) in CONFLICT_STATUSES
+
+
+class SnapshotResult(object):
+    """Number of records of each stage written to a snapshot."""
+
+    def __init__(self, path):
+        self.path = path
+        self.counts = dict((stage, 0) for stage in STAGES)
+        self.blobs = 0
+
+    def __repr__(self):
+        return '<SnapshotResult %s: %s, %d blobs>' % (
+            self.path, ', '.join('%d %s' % (self.counts[stage], stage)
+                                 for stage in STAGES), self.blobs)
+
+
+class RestoreResult(object):
+    """Outcome of a restore.
+
+    `restored` maps each stage to the number of records written and
+    `errors` maps ``(stage, key)`` of each failed record to its exception.
+    """
+
+    def __init__(self):
+        self.restored = dict((stage, 0) for stage in STAGES)
+        self.errors = {}
+
+    def __repr__(self):
+        return '<RestoreResult: %s, %d failed>' % (
+            ', '.join('%d %s' % (self.restored[stage], stage)
+                      for stage in STAGES), len(self.errors))
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+class Snapshotter(object):
+    """Takes and restores snapshots of the instance `client` talks to.
+
+    :param client: Client authenticated as a Grafana server admin
+    :param max_workers: maximum number of concurrent requests
+    """
+
+    def __init__(self, client, max_workers=8):
+        self.client = client
+        self.max_workers = max_workers
+
+    def snapshot(self, path):
+        """Write a snapshot of every org to the archive at `path`.
+
+        :returns: SnapshotResult
+        """
+        result = SnapshotResult(path)
+        orgs = self.client.orgs.list()
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED,
+                             allowZip64=True) as archive:
+            counts = result.counts
+            counts['orgs'] = self._write_records(
+                archive, 'orgs', (org.to_dict() for org in orgs))
+            counts['users'] = self._write_records(
+                archive, 'users',
+                (user.to_dict() for user in self.client.users.iter_users()))
+            counts['memberships'] = self._write_records(
+                archive, 'memberships', self._iter_memberships(orgs))
+            counts['datasources'] = self._write_records(
+                archive, 'datasources', self._iter_datasources(orgs))
+            counts['dashboards'] = self._write_records(
+                archive, 'dashboards',
+                self._iter_dashboards(archive, orgs, result))
+            manifest = {'format': FORMAT_VERSION, 'created': time.time(),
+                        'counts': counts, 'blobs': result.blobs}
+            archive.writestr('manifest.json', _encode(manifest))
+        return result
+
+    def restore(self, path, password=None):
+        """Recreate the contents of the snapshot at `path`.
+
+        Stages are replayed in dependency order; the records of a stage are
+        written concurrently. Failed records are collected instead of
+        aborting the restore.
+
+        :param password: password given to restored users that do not exist
+            yet (a random one per user by default)
+        :returns: RestoreResult
+        """
+        result = RestoreResult()
+        with zipfile.ZipFile(path, 'r', allowZip64=True) as archive:
+            manifest = jsonutils.loads(archive.read('manifest.json'))
+            if manifest.get('format') != FORMAT_VERSION:
+                raise ValueError('Unsupported snapshot format: %s' %
+                                 manifest.get('format'))
+
+            org_ids = dict((org.name, org.id)
+                           for org in self.client.orgs.list())
+            self._restore_stage(
+                result, 'orgs', self._restore_org,
+                (org for org in self._read_records(archive, 'orgs')
+                 if org['name'] not in org_ids),
+                key=lambda org: org['name'])
+            org_ids = dict((org.name, org.id)
+                           for org in self.client.orgs.list())
+            clients = dict((name, self.client.scoped(org_id))
+                           for name, org_id in org_ids.items())
+
+            def restore_user(user):
+                return self._restore_user(user, password)
+
+            def restore_membership(member):
+                return self._restore_membership(org_ids[member['org']],
+                                                member)
+
+            def restore_datasource(record):
+                return self._restore_datasource(clients[record['org']],
+                                                record['datasource'])
+
+            def restore_dashboard(item):
+                record, dashboard = item
+                return clients[record['org']].dashboards._import(dashboard)
+
+            self._restore_stage(
+                result, 'users', restore_user,
+                self._read_records(archive, 'users'),
+                key=lambda user: user['login'])
+            self._restore_stage(
+                result, 'memberships', restore_membership,
+                self._read_records(archive, 'memberships'),
+                key=lambda member: (member['org'], member['login']))
+            self._restore_stage(
+                result, 'datasources', restore_datasource,
+                self._read_records(archive, 'datasources'),
+                key=lambda record: (record['org'],
+                                    record['datasource']['name']))
+            self._restore_stage(
+                result, 'dashboards', restore_dashboard,
+                self._read_dashboards(archive),
+                key=lambda item: (item[0]['org'],
+                                  item[0]['uid'] or item[0]['title']))
+        return result
+
+    def _write_records(self, archive, stage, records):
+        """Spool `records` to a temporary file and add it to `archive`.
+
+        zipfile can only add one entry at a time, and blobs are added while
+        the dashboard records are still being produced.
+        """
+        fd, tmp_path = tempfile.mkstemp(suffix='.jsonl')
+        count = 0
+        try:
+            with io.open(fd, 'wb') as f:
+                for record in records:
+                    f.write(_encode(record))
+                    f.write(b'\n')
+                    count += 1
+            archive.write(tmp_path, '%s.jsonl' % stage)
+        finally:
+            os.remove(tmp_path)
+        return count
+
+    @staticmethod
+    def _read_records(archive, stage):
+        with archive.open('%s.jsonl' % stage) as f:
+            for line in f:
+                if line.strip():
+                    yield jsonutils.loads(line)
+
+    def _read_dashboards(self, archive):
+        # Blobs are read here rather than in the workers: the archive is
+        # only ever read from one thread.
+        for record in self._read_records(archive, 'dashboards'):
+            blob = archive.read('blobs/%s.json' % record['blob'])
+            yield record, jsonutils.loads(blob)
+
+    def _for_each_org(self, func, orgs):
+        """Yield the items `func(scoped_client, org)` returns for each org."""
+        def fetch(org):
+            return func(self.client.scoped(org.id), org)
+
+        for org, items, error in concurrency.imap_unordered(
+                fetch, orgs, self.max_workers):
+            if error is not None:
+                raise error
+            for item in items:
+                yield item
+
+    def _iter_memberships(self, orgs):
+        def fetch(client, org):
+            return [{'org': org.name, 'login': member.login,
+                     'role': member.role}
+                    for member in client.orgs.users.list(org.id)]
+        return self._for_each_org(fetch, orgs)
+
+    def _iter_datasources(self, orgs):
+        def fetch(client, org):
+            return [{'org': org.name, 'datasource': ds.to_dict()}
+                    for ds in client.datasources.list()]
+        return self._for_each_org(fetch, orgs)
+
+    def _iter_dashboards(self, archive, orgs, result):
+        def hits():
+            for org in orgs:
+                client = self.client.scoped(org.id)
+                # Paged: a plain search returns at most 1000 hits.
+                for hit in client.dashboards.iter_search():
+                    if getattr(hit, 'type', None) != 'dash-folder':
+                        yield client, org, hit
+
+        def fetch(item):
+            client, org, hit = item
+            return client.dashboards.get(hit.uri)._json['dashboard']
+
+        seen = set()
+        for (client, org, hit), dashboard, error in \
+                concurrency.imap_unordered(fetch, hits(), self.max_workers):
+            if error is not None:
+                raise error
+            # The fetched document may be shared with the response cache.
+            dashboard = dict(dashboard)
+            for field in DASHBOARD_VOLATILE_FIELDS:
+                dashboard.pop(field, None)
+            data = _encode(dashboard, sort_keys=True)
+            sha = hashlib.sha256(data).hexdigest()
+            if sha not in seen:
+                seen.add(sha)
+                archive.writestr('blobs/%s.json' % sha, data)
+                result.blobs += 1
+            yield {'org': org.name, 'uid': dashboard.get('uid'),
+                   'title': dashboard.get('title'), 'blob': sha}
+
+    def _restore_stage(self, result, stage, func, records, key):
+        for record, _, error in concurrency.imap_unordered(
+                func, records, self.max_workers):
+            if error is not None:
+                result.errors[(stage, key(record))] = error
+            else:
+                result.restored[stage] += 1
+
+    def _restore_org(self, org):
+        return self.client.orgs.create(org['name'])
+
+    def _restore_user(self, user, password=None):
+        if password is None:
+            password = binascii.hexlify(os.urandom(16)).decode('ascii')
+        try:
+            return self.client.users.create(user['login'], password,
+                                            name=user.get('name'),
+                                            email=user.get('email'))
+        except exceptions.HTTPException as e:
+            if not _conflict(e):
+                raise
+
+    def _restore_membership(self, org_id, member):
+        org_users = self.client.orgs.users
+        try:
+            return org_users.add(member['role'], member['login'],
+                                 orgid=org_id)
+        except exceptions.HTTPException as e:
+            if not _conflict(e):
+                raise
+        # Already a member, e.g. of the default org: set the role instead.
+        return org_users.update(member['role'],
+                                self._user_id(member['login']),
+                                orgid=org_id)
+
+    def _user_id(self, login):
+        # Searched rather than looked up in /api/users, which Grafana pages.
+        for user in self.client.users.iter_users(query=login):
+            if user.login == login:
+                return user.id
+        raise exceptions.NotFound('No User with login %r' % login)
+
+    def _restore_datasource(self, client, datasource):
+        datasource = dict((k, v) for k, v in datasource.items()
+                          if k not in ('id', 'orgId'))
+        try:
+            return client.datasources.create(datasource)
+        except exceptions.HTTPException as e:
+            if not _conflict(e):
+                raise
+        existing = client.datasources.by_name(datasource['name'])
+        return client.datasources.update(existing.id,
+                                         dict(datasource, id=existing.id))
@@ -0,0 +1,97 @@
+"""
+AsyncClient against the in-process fake Grafana server.
+
+    python -m pytest tests
+"""
+
+import importlib
+import os
+import sys
+import threading
+import time
+import unittest
+from concurrent import futures
+
+# Test the checkout this file lives in, importing it as a package named
+# after its directory, as benchmarks/run.py does.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+client = importlib.import_module(PACKAGE + '.client')
+
+from fakegrafana import FakeGrafana  # noqa: E402
+
+
+class AsyncClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGrafana(orgs=2, users=20, dashboards=10,
+                                  panels=2, datasources=2).start()
+        self.addCleanup(self.server.stop)
+        self.client = client.AsyncClient(self.server.url, username='admin',
+                                         password='admin', max_workers=3)
+        self.addCleanup(self.client.close)
+
+    def test_calls_return_futures(self):
+        future = self.client.dashboards.get('db/dashboard-1')
+        self.assertIsInstance(future, futures.Future)
+        dashboard = future.result(timeout=10)
+        self.assertEqual(dashboard._json['dashboard']['uid'],
+                         self.server.dashboards[1]['uid'])
+
+    def test_results_match_sync_client(self):
+        uris = ['db/dashboard-%d' % i for i in range(1, 11)]
+        pending = [self.client.dashboards.get(uri) for uri in uris]
+        titles = [f.result(timeout=10).title for f in pending]
+        sync = self.client.client
+        self.assertEqual(titles, [sync.dashboards.get(uri).title
+                                  for uri in uris])
+
+    def test_errors_are_raised_by_result(self):
+        future = self.client.dashboards.get('db/no-such-dashboard')
+        with self.assertRaises(Exception) as cm:
+            future.result(timeout=10)
+        self.assertEqual(getattr(cm.exception, 'status_code', None), 404)
+
+    def test_sub_managers_are_wrapped(self):
+        org_users = self.client.orgs.users
+        self.assertIsInstance(org_users, client.AsyncManager)
+        future = org_users.list(1)
+        self.assertIsInstance(future, futures.Future)
+        self.assertTrue(future.result(timeout=10))
+
+    def test_attributes_are_not_wrapped(self):
+        self.assertEqual(self.client.dashboards.cache_namespace,
+                         'dashboards')
+
+    def test_concurrency_limit(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+        route = self.server.route
+
+        def slow_route(*args, **kwargs):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            try:
+                time.sleep(0.05)
+                return route(*args, **kwargs)
+            finally:
+                with lock:
+                    state['running'] -= 1
+
+        self.server.route = slow_route
+        self.server.reset_connections()
+        pending = [self.client.dashboards.get('db/dashboard-%d' % (i % 10 + 1))
+                   for i in range(30)]
+        for future in pending:
+            future.result(timeout=30)
+        self.assertLessEqual(state['peak'], self.client.max_workers)
+        self.assertGreater(state['peak'], 1)
+        self.assertLessEqual(self.server.max_connections,
+                             self.client.max_workers)
+
+
+if __name__ == '__main__':
+    unittest.main()
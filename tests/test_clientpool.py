@@ -0,0 +1,91 @@
+"""
+ClientPool under concurrent use against the in-process fake Grafana server.
+
+    python -m pytest tests
+"""
+
+import importlib
+import os
+import sys
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+client = importlib.import_module(PACKAGE + '.client')
+
+from fakegrafana import FakeGrafana  # noqa: E402
+
+THREADS = 16
+REPEAT = 10
+MAX_CONNECTIONS = 4
+
+
+class ClientPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        # Some latency so requests overlap and contend for connections.
+        self.server = FakeGrafana(orgs=6, users=1, dashboards=1, panels=1,
+                                  datasources=1, latency=0.005).start()
+        self.addCleanup(self.server.stop)
+        self.logins = []
+        route = self.server.route
+
+        def record(method, path, query, body, org_id=None):
+            if path == '/login':
+                self.logins.append(org_id)
+            return route(method, path, query, body, org_id)
+
+        self.server.route = record
+        self.pool = client.ClientPool(self.server.url, username='admin',
+                                      password='admin',
+                                      max_connections=MAX_CONNECTIONS)
+        self.addCleanup(self.pool.close)
+
+    def stress(self):
+        org_ids = [org['id'] for org in self.server.orgs]
+        errors = []
+
+        def work(i):
+            for n in range(REPEAT):
+                org_id = org_ids[(i + n) % len(org_ids)]
+                try:
+                    org = self.pool.get(org_id).orgs.get()
+                except Exception as e:
+                    errors.append(e)
+                else:
+                    if org.id != org_id:
+                        errors.append('asked org %s, got %s' % (org_id,
+                                                               org.id))
+
+        workers = [threading.Thread(target=work, args=(i,))
+                   for i in range(THREADS)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return errors
+
+    def test_responses_belong_to_the_requested_org(self):
+        self.assertEqual(self.stress(), [])
+        self.assertEqual(len(self.pool), len(self.server.orgs))
+
+    def test_connection_limit(self):
+        self.server.reset_connections()
+        self.assertEqual(self.stress(), [])
+        self.assertLessEqual(self.server.max_connections, MAX_CONNECTIONS)
+        self.assertGreater(self.server.max_connections, 1)
+
+    def test_one_login_per_user(self):
+        self.assertEqual(self.stress(), [])
+        self.assertEqual(len(self.logins), 1)
+
+    def test_same_client_per_org(self):
+        self.assertIs(self.pool.get(2), self.pool.get(2))
+        self.assertIsNot(self.pool.get(2), self.pool.get(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Dashboard writes against the in-process fake Grafana server.
+
+    python -m pytest tests
+"""
+
+import importlib
+import json
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+client = importlib.import_module(PACKAGE + '.client')
+dashboards = importlib.import_module(PACKAGE + '.dashboards')
+cache = importlib.import_module(PACKAGE + '.utils.cache')
+
+from fakegrafana import FakeGrafana  # noqa: E402
+
+
+class DashboardSaveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGrafana(orgs=1, users=1, dashboards=4, panels=2,
+                                  datasources=1).start()
+        self.addCleanup(self.server.stop)
+        self.saved = []
+        route = self.server.route
+
+        def record(method, path, query, body, org_id=None):
+            if method == 'POST' and path == '/api/dashboards/db':
+                self.saved.append(json.loads(body.decode()))
+            return route(method, path, query, body, org_id)
+
+        self.server.route = record
+        self.client = client.Client(self.server.url, username='admin',
+                                    password='admin')
+        self.addCleanup(self.client.close)
+
+    def folders(self):
+        return dict((body['dashboard']['uid'],
+                     body.get('folderUid', body.get('folderId')))
+                    for body in self.saved)
+
+    def test_patch_keeps_folder(self):
+        self.client.dashboards.get('db/dashboard-2').patch(
+            [{'op': 'replace', 'path': '/title', 'value': 'x'}])
+        self.assertEqual(self.folders(), {'dash00002': 'folder1'})
+
+    def test_transform_keeps_folders(self):
+        result = self.client.dashboards.transform(
+            dashboards.datasource_rename('prometheus', 'thanos'))
+        self.assertTrue(result.ok)
+        self.assertEqual(self.folders(), {'dash00001': '', 'dash00002':
+                                          'folder1', 'dash00003': '',
+                                          'dash00004': 'folder1'})
+
+    def test_hit_update_keeps_folder(self):
+        hit = self.client.dashboards.by_uid('dash00004')
+        hit.update({'uid': 'dash00004', 'title': 'x'})
+        self.assertEqual(self.folders(), {'dash00004': 'folder1'})
+
+    def test_folder_of(self):
+        self.assertEqual(dashboards.folder_of({'folderUid': 'f'}),
+                         {'folder_uid': 'f'})
+        self.assertEqual(dashboards.folder_of({'folderId': 3}),
+                         {'folder_id': 3})
+        self.assertEqual(dashboards.folder_of({}), {})
+
+
+class CachedDashboardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGrafana(orgs=1, users=1, dashboards=2, panels=2,
+                                  datasources=1).start()
+        self.addCleanup(self.server.stop)
+        self.cache = cache.ResponseCache()
+        self.client = client.Client(self.server.url, username='admin',
+                                    password='admin', cache=self.cache)
+        self.addCleanup(self.client.close)
+
+    def test_edits_do_not_reach_the_cache(self):
+        for _ in range(2):
+            dashboard = self.client.dashboards.get('db/dashboard-1')
+            self.assertEqual(dashboard._json['dashboard']['title'],
+                             'Dashboard 1')
+            dashboard._json['dashboard']['title'] = 'x'
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_writes_do_not_modify_arguments(self):
+        dashboard = {'title': 'New'}
+        self.client.dashboards.create(dashboard)
+        self.client.dashboards._import(dashboard)
+        self.client.dashboards.update(1, dashboard)
+        self.assertEqual(dashboard, {'title': 'New'})
+
+
+if __name__ == '__main__':
+    unittest.main()
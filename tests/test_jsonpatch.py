@@ -0,0 +1,179 @@
+"""
+Structural diff and patch of decoded JSON documents.
+
+    python -m pytest tests
+"""
+
+import copy
+import importlib
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+sys.path.insert(0, os.path.dirname(ROOT))
+jsonpatch = importlib.import_module(PACKAGE + '.utils.jsonpatch')
+exceptions = importlib.import_module(PACKAGE + '.utils.exceptions')
+
+
+def make_doc():
+    return {'title': 'Home', 'tags': ['a', 'b'], 'editable': True,
+            'panels': [{'id': 1, 'targets': [{'expr': 'up'}]},
+                       {'id': 2, 'targets': []}],
+            'time': {'from': 'now-6h', 'to': 'now'}}
+
+
+class ApplyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = make_doc()
+        self.original = copy.deepcopy(self.doc)
+
+    def tearDown(self):
+        # No operation, applied or failed, may modify the input.
+        self.assertEqual(self.doc, self.original)
+
+    def apply(self, *operations):
+        return jsonpatch.apply(self.doc, list(operations))
+
+    def test_add_key(self):
+        result = self.apply({'op': 'add', 'path': '/refresh', 'value': '5s'})
+        self.assertEqual(result['refresh'], '5s')
+
+    def test_add_array_element(self):
+        result = self.apply({'op': 'add', 'path': '/tags/1', 'value': 'x'},
+                            {'op': 'add', 'path': '/tags/-', 'value': 'z'})
+        self.assertEqual(result['tags'], ['a', 'x', 'b', 'z'])
+
+    def test_add_whole_document(self):
+        self.assertEqual(self.apply({'op': 'add', 'path': '', 'value': {}}),
+                         {})
+
+    def test_remove(self):
+        result = self.apply({'op': 'remove', 'path': '/panels/0/targets/0'},
+                            {'op': 'remove', 'path': '/time'})
+        self.assertEqual(result['panels'][0]['targets'], [])
+        self.assertNotIn('time', result)
+
+    def test_replace(self):
+        result = self.apply({'op': 'replace',
+                             'path': '/panels/0/targets/0/expr',
+                             'value': 'down'})
+        self.assertEqual(result['panels'][0]['targets'][0]['expr'], 'down')
+
+    def test_replace_escaped_key(self):
+        self.doc['a/b~c'] = 1
+        self.original['a/b~c'] = 1
+        result = self.apply({'op': 'replace', 'path': '/a~1b~0c',
+                             'value': 2})
+        self.assertEqual(result['a/b~c'], 2)
+
+    def test_move(self):
+        result = self.apply({'op': 'move', 'from': '/time/from',
+                             'path': '/time/start'})
+        self.assertEqual(result['time'], {'start': 'now-6h', 'to': 'now'})
+
+    def test_copy(self):
+        result = self.apply({'op': 'copy', 'from': '/panels/0',
+                             'path': '/panels/-'},
+                            {'op': 'replace', 'path': '/panels/2/id',
+                             'value': 3})
+        self.assertEqual([p['id'] for p in result['panels']], [1, 2, 3])
+        self.assertEqual(result['panels'][0]['id'], 1)
+
+    def test_test(self):
+        self.assertIs(self.apply({'op': 'test', 'path': '/title',
+                                  'value': 'Home'}), self.doc)
+
+    def test_unchanged_subtrees_are_shared(self):
+        result = self.apply({'op': 'replace', 'path': '/panels/1/id',
+                             'value': 5})
+        self.assertIsNot(result, self.doc)
+        self.assertIsNot(result['panels'], self.doc['panels'])
+        self.assertIs(result['panels'][0], self.doc['panels'][0])
+        self.assertIs(result['time'], self.doc['time'])
+
+    def test_noop_returns_input(self):
+        self.assertIs(self.apply(), self.doc)
+        self.assertIs(self.apply({'op': 'replace', 'path': '/title',
+                                  'value': 'Home'},
+                                 {'op': 'add', 'path': '/time',
+                                  'value': {'from': 'now-6h', 'to': 'now'}}),
+                      self.doc)
+        self.assertIs(self.apply({'op': 'move', 'from': '/title',
+                                  'path': '/title'}), self.doc)
+
+    def test_values_of_another_type_differ(self):
+        result = self.apply({'op': 'replace', 'path': '/editable',
+                             'value': 1})
+        self.assertIsNot(result, self.doc)
+        self.assertIs(type(result['editable']), int)
+        result = self.apply({'op': 'add', 'path': '/panels/0/targets',
+                             'value': [{'expr': 'up', 'hide': 0}]})
+        self.assertIsNot(result, self.doc)
+
+    def test_failed_patch_leaves_input_alone(self):
+        with self.assertRaises(exceptions.PatchError):
+            self.apply({'op': 'replace', 'path': '/title', 'value': 'x'},
+                       {'op': 'remove', 'path': '/missing'})
+
+    def test_errors(self):
+        invalid = [
+            {'op': 'remove', 'path': '/missing'},
+            {'op': 'remove', 'path': '/tags/2'},
+            {'op': 'remove', 'path': ''},
+            {'op': 'replace', 'path': '/missing', 'value': 1},
+            {'op': 'replace', 'path': '/tags/x', 'value': 1},
+            {'op': 'add', 'path': '/title/x', 'value': 1},
+            {'op': 'add', 'path': '/missing/x', 'value': 1},
+            {'op': 'add', 'path': 'title', 'value': 1},
+            {'op': 'add', 'path': '/title'},
+            {'op': 'replace', 'path': '/title'},
+            {'op': 'move', 'path': '/title'},
+            {'op': 'move', 'from': '/time', 'path': '/time/x'},
+            {'op': 'copy', 'from': '/missing', 'path': '/x'},
+            {'op': 'test', 'path': '/title', 'value': 'Other'},
+            {'op': 'test', 'path': '/editable', 'value': 1},
+            {'op': 'test', 'path': '/title'},
+            {'op': 'frobnicate', 'path': '/title'},
+            {'path': '/title'},
+            'not an operation',
+        ]
+        for operation in invalid:
+            with self.assertRaises(exceptions.PatchError,
+                                   msg=repr(operation)):
+                self.apply(operation)
+
+    def test_patch_error_is_value_error(self):
+        with self.assertRaises(ValueError):
+            self.apply({'op': 'remove', 'path': '/missing'})
+
+
+class DiffTest(unittest.TestCase):
+
+    def test_identical(self):
+        doc = make_doc()
+        self.assertEqual(jsonpatch.diff(doc, doc), [])
+        self.assertEqual(jsonpatch.diff(doc, make_doc()), [])
+
+    def test_round_trip(self):
+        src = make_doc()
+        dst = make_doc()
+        dst['title'] = 'Other'
+        dst['editable'] = 1
+        del dst['time']
+        dst['tags'] = ['a']
+        dst['panels'].append({'id': 3})
+        dst['panels'][0]['targets'][0]['expr'] = 'down'
+        patch = jsonpatch.diff(src, dst)
+        self.assertEqual(jsonpatch.apply(src, patch), dst)
+        self.assertEqual(src, make_doc())
+
+    def test_type_change(self):
+        self.assertEqual(jsonpatch.diff({'a': True}, {'a': 1}),
+                         [{'op': 'replace', 'path': '/a', 'value': 1}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+Indexed lookups (by_name, by_login, by_uid, ...) against the in-process
+fake Grafana server.
+
+    python -m pytest tests
+"""
+
+import importlib
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+client = importlib.import_module(PACKAGE + '.client')
+exceptions = importlib.import_module(PACKAGE + '.utils.exceptions')
+
+from fakegrafana import FakeGrafana  # noqa: E402
+
+
+class LookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGrafana(orgs=20, users=1500, dashboards=1200,
+                                  panels=1, datasources=2).start()
+        self.addCleanup(self.server.stop)
+        self.paths = []
+        route = self.server.route
+
+        def record(method, path, query, body, org_id=None):
+            self.paths.append(path)
+            return route(method, path, query, body, org_id)
+
+        self.server.route = record
+        self.client = client.Client(self.server.url, username='admin',
+                                    password='admin')
+        self.addCleanup(self.client.close)
+
+    def test_org_index_survives_org_switches(self):
+        for _ in range(3):
+            for org in self.server.orgs:
+                self.client.switch_org(org['name'])
+        self.assertEqual(self.paths.count('/api/orgs'), 1)
+
+    def test_org_scoped_index_is_rebuilt_per_org(self):
+        for org in self.server.orgs[:3]:
+            self.client.switch_org(org['name'])
+            self.client.datasources.by_name('datasource1')
+        self.assertEqual(self.paths.count('/api/datasources'), 3)
+
+    def test_users_past_the_first_page(self):
+        self.assertEqual(self.client.users.by_login('user1400').id, 1400)
+        self.assertEqual(
+            self.client.users.by_email('user1500@example.com').id, 1500)
+        with self.assertRaises(exceptions.NotFound):
+            self.client.users.by_login('nobody')
+
+    def test_dashboards_past_the_first_page(self):
+        self.assertEqual(self.client.dashboards.by_uid('dash01100').id, 1100)
+        self.assertEqual(
+            self.client.dashboards.by_slug('dashboard-1200').uid,
+            'dash01200')
+        with self.assertRaises(exceptions.NotFound):
+            self.client.dashboards.by_uid('nothing')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+Dashboard reconciliation against the in-process fake Grafana server.
+
+    python -m pytest tests
+"""
+
+import importlib
+import json
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+client = importlib.import_module(PACKAGE + '.client')
+reconcile = importlib.import_module(PACKAGE + '.reconcile')
+
+from fakegrafana import FakeGrafana  # noqa: E402
+
+# Dashboard 1 (General) and dashboard 2 (folder 'folder1') share a title.
+TITLES = {1: 'Shared', 2: 'Shared'}
+
+
+class ReconcileDashboardsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGrafana(orgs=1, users=1, dashboards=4, panels=1,
+                                  datasources=1).start()
+        self.addCleanup(self.server.stop)
+        self.saved = []
+        route = self.server.route
+
+        def patched(method, path, query, body, org_id=None):
+            if method == 'POST' and path == '/api/dashboards/db':
+                self.saved.append(json.loads(body.decode()))
+            status, content_type, payload = route(method, path, query, body,
+                                                  org_id)
+            if path == '/api/search':
+                if isinstance(payload, bytes):
+                    payload = json.loads(payload.decode())
+                for hit in payload:
+                    hit['title'] = TITLES.get(hit['id'], hit['title'])
+            return status, content_type, payload
+
+        self.server.route = patched
+        self.client = client.Client(self.server.url, username='admin',
+                                    password='admin')
+        self.addCleanup(self.client.close)
+        self.reconciler = reconcile.Reconciler(self.client)
+
+    def reconcile(self, *dashboards):
+        result = self.reconciler.reconcile(
+            {'Org 1': {'dashboards': list(dashboards)}})
+        self.assertTrue(result.ok, result.errors)
+        return dict((body['dashboard'].get('uid'),
+                     body.get('folderUid', body.get('folderId')))
+                    for body in self.saved)
+
+    def test_ambiguous_title_is_an_error(self):
+        with self.assertRaises(ValueError):
+            self.reconciler.plan(
+                {'Org 1': {'dashboards': [{'title': 'Shared'}]}})
+
+    def test_folder_picks_title_match(self):
+        saved = self.reconcile({'title': 'Shared', 'folderUid': 'folder1',
+                                'editable': False})
+        self.assertEqual(saved, {None: 'folder1'})
+        self.assertEqual(self.saved[0]['dashboard']['id'], 2)
+        self.assertNotIn('folderUid', self.saved[0]['dashboard'])
+
+    def test_update_keeps_folder(self):
+        saved = self.reconcile({'title': 'Dashboard 4', 'editable': False},
+                               {'uid': 'dash00003', 'title': 'Dashboard 3',
+                                'editable': False})
+        self.assertEqual(saved, {None: 'folder1', 'dash00003': ''})
+
+    def test_folder_change_is_an_update(self):
+        changes = self.reconciler.plan(
+            {'Org 1': {'dashboards': [
+                {'uid': 'dash00003', 'title': 'Dashboard 3',
+                 'folderUid': 'folder1'},
+                {'uid': 'dash00004', 'title': 'Dashboard 4',
+                 'folderUid': 'folder1'}]}})
+        self.assertEqual([(c.key, c.fields) for c in changes],
+                         [('dash00003', ['folderUid'])])
+
+    def test_create_in_folder(self):
+        saved = self.reconcile({'uid': 'new', 'title': 'New',
+                                'folderUid': 'folder1'})
+        self.assertEqual(saved, {'new': 'folder1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
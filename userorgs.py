@@ -1,4 +1,5 @@
-from twcmanage.lib.grafanaclient.utils import base
+from .utils import base
+from .utils import exceptions
 
 
 class UserOrg(base.Resource):
@@ -8,6 +9,8 @@ class UserOrg(base.Resource):
 
 class UserOrgManager(base.BaseManager):
     resource_class = UserOrg
+    cache_namespace = 'userorgs'
+    org_scoped = False
 
     def list(self, userid=None):
         """List orgs for user."""
@@ -17,5 +20,16 @@ class UserOrgManager(base.BaseManager):
             return self._list("/api/user/orgs")
 
     def switch_current(self, orgid):
-        """Switch active org. Current user only."""
-        return self._post("/api/user/using/%s" % orgid)
+        """Switch active org. Current user only.
+
+        Not allowed on thread-safe clients: the current org is shared by
+        every thread (and every session) of the user.
+        """
+        if getattr(self.client, 'thread_safe', False):
+            raise exceptions.GrafanaException(
+                "Cannot switch the current org of a thread-safe client, "
+                "use a client scoped to org %s instead" % orgid)
+        resp = self._post("/api/user/using/%s" % orgid)
+        # Org-scoped responses are cached per org, see BaseManager._get_body.
+        self.client.org_id = orgid
+        return resp
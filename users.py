@@ -1,5 +1,5 @@
-from twcmanage.lib.grafanaclient.utils import base
-import userorgs
+from .utils import base
+from . import userorgs
 
 
 # Users generated by get do not include ids and cannot run the User methods.
@@ -19,6 +19,8 @@ class User(base.Resource):
 
 class UserManager(base.BaseManager):
     resource_class = User
+    cache_namespace = 'users'
+    org_scoped = False
 
     def __init__(self, client):
         super(UserManager, self).__init__(client)
@@ -43,10 +45,37 @@ class UserManager(base.BaseManager):
         else:
             return self._get('/api/user')
 
+    def batched_get(self, userid):
+        """Get user, batching concurrent lookups into one list call.
+
+        Returns the entry from the list call, or from a single GET when the
+        list (which Grafana may page) does not include it; raises NotFound
+        if there is none.
+        """
+        return self._batched_get(userid)
+
     def list(self):
         """List all users."""
         return self._list('/api/users')
 
+    def iter_users(self, query=None, page_size=1000):
+        """Lazily iterate over all users page by page. Admin only.
+
+        :param query: only users whose login, email or name match
+        :param page_size: number of users fetched per request
+        """
+        return self._iter_pages('/api/users/search', {'query': query},
+                                items_key='users', page_size=page_size)
+
+    def by_login(self, login):
+        """Get user by login. Raises NotFound if there is none."""
+        # Paged: /api/users returns at most 1000 users.
+        return self._lookup('login', login, items=self.iter_users)
+
+    def by_email(self, email):
+        """Get user by email. Raises NotFound if there is none."""
+        return self._lookup('email', email, items=self.iter_users)
+
     def update(self, email=None, name=None, login=None, userid=None):
         """Update user."""
         data = {}
@@ -25,8 +25,14 @@ Base utilities to build API operation managers and objects on top of.
 # E1102: %s is not callable
 # pylint: disable=E1102
 
-import copy
 import six
+import threading
+
+from six.moves.urllib.parse import urlencode
+
+from . import cache
+from . import concurrency
+from . import exceptions
 
 
 class BaseManager(object):
@@ -36,6 +42,11 @@ class BaseManager(object):
     etc.) and provide CRUD operations for them.
     """
     resource_class = None
+    # Group name of this manager's entries in the client's response cache.
+    cache_namespace = None
+    # Whether responses depend on the client's org, e.g. dashboards; caches
+    # and lookup indexes of org-independent managers are shared by all orgs.
+    org_scoped = True
 
     def __init__(self, client):
         """Initializes BaseManager with `client`.
@@ -44,6 +55,14 @@ class BaseManager(object):
         """
         super(BaseManager, self).__init__()
         self.client = client
+        self._indexes = {}
+        self._index_lock = threading.Lock()
+        self._batcher = None
+
+    @property
+    def compact(self):
+        """Whether resources keep their fields in a single dict."""
+        return getattr(self.client, 'compact_resources', False)
 
     def _list(self, url, obj_class=None, json=None):
         """List the collection.
@@ -55,15 +74,50 @@ class BaseManager(object):
             request (GET will be sent by default)
         """
         if json:
-            body = self.client.post(url, json=json).json()
+            resp, body = self.client.json_request('POST', url, json=json)
         else:
-            body = self.client.get(url).json()
+            body = self._get_body(url)
 
         if obj_class is None:
             obj_class = self.resource_class
 
         return [obj_class(self, res) for res in body if res]
 
+    def _iter_pages(self, url, params=None, items_key=None, page_size=1000,
+                    size_param='perpage', obj_class=None):
+        """Lazily walk a paginated collection.
+
+        Pages are fetched one at a time as the generator is consumed, so
+        memory use does not grow with the size of the collection.
+
+        :param url: a partial URL without query string, e.g., '/api/search'
+        :param params: extra query parameters; list values are repeated
+        :param items_key: key of the item list in each page, or None when
+            the page body is the list itself
+        :param page_size: number of items requested per page
+        :param size_param: name of the page size parameter
+        :param obj_class: class for constructing the returned objects
+            (self.resource_class will be used by default)
+        """
+        if obj_class is None:
+            obj_class = self.resource_class
+        query = dict((k, v) for k, v in six.iteritems(params or {})
+                     if v is not None)
+        query[size_param] = page_size
+        page = 1
+        while True:
+            query['page'] = page
+            body = self._get_body(
+                '%s?%s' % (url, urlencode(query, doseq=True)))
+            items = body if items_key is None else body.get(items_key)
+            items = items or []
+            for item in items:
+                if item:
+                    yield obj_class(self, item)
+            if len(items) < page_size:
+                return
+            page += 1
+
     def _get(self, url, obj_class=None):
         """Get an object from collection.
 
@@ -71,11 +125,116 @@ class BaseManager(object):
         :param obj_class: class for constructing the returned objects
             (self.resource_class will be used by default)
         """
-        body = self.client.get(url).json()
         if obj_class is None:
             obj_class = self.resource_class
+        # JsonResource exposes its document for editing, so it must not
+        # be the one held by the cache.
+        body = self._get_body(url, private=issubclass(obj_class, JsonResource))
         return obj_class(self, body)
 
+    def _get_body(self, url, private=False):
+        """GET `url` and return the decoded body.
+
+        Served from the client's response cache when one is configured, and
+        shared with identical GETs already in flight when the client
+        coalesces requests. Such a shared body must be treated as read-only.
+
+        :param private: return a copy the caller may modify whenever the
+            body is shared
+        """
+        key = (self._org_key(), url)
+        response_cache = getattr(self.client, 'cache', None)
+        if self.cache_namespace is None:
+            response_cache = None
+        if response_cache is not None:
+            body = response_cache.get(self.cache_namespace, key)
+            if body is not cache.MISSING:
+                return copy_json(body) if private else body
+
+        single_flight = getattr(self.client, 'single_flight', None)
+        if single_flight is not None:
+            body = single_flight.do(
+                key, lambda: self.client.json_request('GET', url)[1])
+        else:
+            body = self.client.json_request('GET', url)[1]
+
+        if response_cache is not None:
+            response_cache.set(self.cache_namespace, key, body)
+        if private and (response_cache is not None or
+                        single_flight is not None):
+            body = copy_json(body)
+        return body
+
+    def _batched_get(self, id, key='id'):
+        """Get a resource through a MicroBatcher over self.list().
+
+        Lookups issued by many threads at about the same time are answered
+        by a single list call. Ids missing from it, e.g. because Grafana
+        pages the list, are fetched one by one with self.get.
+        """
+        with self._index_lock:
+            batcher = self._batcher
+            if batcher is None:
+                batcher = self._batcher = concurrency.MicroBatcher(
+                    lambda: dict((getattr(res, key), res)
+                                 for res in self.list()))
+        try:
+            return batcher.get(id)
+        except KeyError:
+            pass
+        try:
+            return self.get(id)
+        except exceptions.HTTPException as e:
+            if e.status_code != 404:
+                raise
+        raise exceptions.NotFound("No %s with %s %r" % (
+            self.resource_class.__name__, key, id))
+
+    def _org_key(self):
+        if not self.org_scoped:
+            return None
+        return getattr(self.client, 'org_id', None)
+
+    def _lookup(self, name, value, key=None, items=None):
+        """Find a resource by an attribute in O(1).
+
+        The index is built on first use and rebuilt once when `value` is
+        missing, in case the resource was created elsewhere since.
+
+        :param name: index name, e.g. 'name'
+        :param value: value to look up
+        :param key: callable returning the indexed value of a resource
+            (defaults to the attribute called `name`)
+        :param items: callable returning the resources to index (defaults
+            to self.list), e.g. a paged iterator
+        """
+        if key is None:
+            key = lambda res: getattr(res, name, None)
+        if items is None:
+            items = self.list
+        index_key = (self._org_key(), name)
+        with self._index_lock:
+            index = self._indexes.get(index_key)
+            if index is None or value not in index:
+                index = dict((key(res), res) for res in items())
+                self._indexes[index_key] = index
+        if value in index:
+            return index[value]
+        raise exceptions.NotFound("No %s with %s %r" % (
+            self.resource_class.__name__, name, value))
+
+    def refresh_index(self):
+        """Drop the lookup indexes; they are rebuilt on next use."""
+        with self._index_lock:
+            self._indexes.clear()
+
+    def _invalidate(self):
+        """Drop cached responses this manager's writes may have changed."""
+        self.refresh_index()
+        response_cache = getattr(self.client, 'cache', None)
+        if response_cache is not None and self.cache_namespace is not None:
+            response_cache.invalidate(self.cache_namespace)
+
     def _post(self, url, json=None, return_raw=True):
         """Create an object.
 
@@ -85,10 +244,8 @@ class BaseManager(object):
         :param return_raw: flag to force returning raw JSON instead of
             Python object of self.resource_class
         """
-        if json:
-            body = self.client.post(url, json=json).json()
-        else:
-            body = self.client.post(url).json()
+        resp, body = self.client.json_request('POST', url, json=json or None)
+        self._invalidate()
         if return_raw:
             return body
         return self.resource_class(self, body)
@@ -102,10 +259,10 @@ class BaseManager(object):
         :param return_raw: flag to force returning raw JSON instead of
             Python object of self.resource_class
         """
-        resp = self.client.put(url, json=json)
+        resp, body = self.client.json_request('PUT', url, json=json)
+        self._invalidate()
         # PUT requests may not return a body
-        if resp.content:
-            body = resp.json()
+        if body is not None:
             if return_raw:
                 return body
             return self.resource_class(self, body)
@@ -119,7 +276,8 @@ class BaseManager(object):
         :param return_raw: flag to force returning raw JSON instead of
             Python object of self.resource_class
         """
-        body = self.client.patch(url, json=json).json()
+        resp, body = self.client.json_request('PATCH', url, json=json)
+        self._invalidate()
         if return_raw:
             return body
         return self.resource_class(self, body)
@@ -129,7 +287,9 @@ class BaseManager(object):
 
         :param url: a partial URL, e.g., '/dashboards/my-server'
         """
-        return self.client.delete(url)
+        resp = self.client.delete(url)
+        self._invalidate()
+        return resp
 
 
 class FileManager(object):
@@ -151,9 +311,63 @@ class FileManager(object):
         body = self.client.raw_get(url)
         return body
 
+    def _download(self, url, output, chunk_size=64 * 1024, timeout=None,
+                  retry=None):
+        """Stream a file to disk without holding it in memory.
+
+        :param url: a partial URL, e.g., '/render/dashboard-solo/db/home'
+        :param output: path or writable binary file-like object
+        :param chunk_size: number of bytes read per chunk
+        :param timeout: request timeout in seconds
+        :param retry: per-request retry override, False to never retry
+        :returns: number of bytes written
+        """
+        kwargs = {'stream': True}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        if retry is not None:
+            kwargs['retry'] = retry
+        resp = self.client.raw_get(url, **kwargs)
+        try:
+            if hasattr(output, 'write'):
+                return self._write_chunks(resp, output, chunk_size)
+            with open(output, 'wb') as f:
+                return self._write_chunks(resp, f, chunk_size)
+        finally:
+            resp.close()
+
+    @staticmethod
+    def _write_chunks(resp, f, chunk_size):
+        size = 0
+        for chunk in resp.iter_content(chunk_size):
+            f.write(chunk)
+            size += len(chunk)
+        return size
+
+
+def copy_json(value):
+    """Deep copy a decoded JSON document.
+
+    Much cheaper than copy.deepcopy since JSON data has no shared or
+    recursive references to track.
+    """
+    if isinstance(value, dict):
+        return dict((k, copy_json(v)) for k, v in six.iteritems(value))
+    if isinstance(value, list):
+        return [copy_json(v) for v in value]
+    return value
+
 
 class Resource(object):
-    """Base class for resources."""
+    """Base class for resources.
+
+    By default every field of `info` is also set as an instance attribute.
+    When the manager is in compact mode (``compact_resources=True`` on the
+    client) the fields are only kept in `info` and read through
+    __getattr__, which saves a per-instance attribute dict entry for every
+    field. Attribute assignment never writes to `info`, so the decoded body
+    can be shared with the response cache.
+    """
 
     def __init__(self, manager, info):
         """Populate and bind to a manager.
@@ -163,11 +377,23 @@ class Resource(object):
         """
         self.manager = manager
         self._info = info
-        self._add_details(info)
+        if not getattr(manager, 'compact', False):
+            self._add_details(info)
+
+    def __getattr__(self, name):
+        # Only called when regular lookup fails, i.e. for the fields of
+        # compact resources.
+        info = self.__dict__.get('_info')
+        if info is None or name.startswith('__'):
+            raise AttributeError(name)
+        try:
+            return info[name]
+        except KeyError:
+            raise AttributeError(name)
 
     def __repr__(self):
         reprkeys = sorted(k
-                          for k in self.__dict__.keys()
+                          for k in set(self.__dict__) | set(self._info)
                           if k[0] != '_' and k != 'manager')
         info = ", ".join("%s=%s" % (k, getattr(self, k)) for k in reprkeys)
         return "<%s %s>" % (self.__class__.__name__, info)
@@ -176,7 +402,6 @@ class Resource(object):
         for (k, v) in six.iteritems(info):
             try:
                 setattr(self, k, v)
-                self._info[k] = v
             except AttributeError:
                 # In this case we already defined the attribute on the class
                 pass
@@ -189,7 +414,7 @@ class Resource(object):
         return self._info == other._info
 
     def to_dict(self):
-        return copy.deepcopy(self._info)
+        return copy_json(self._info)
 
 
 class JsonResource(object):
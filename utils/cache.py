@@ -0,0 +1,90 @@
+# Copyright 2016 Time Warner Cable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-process TTL/LRU cache for read-only API calls.
+"""
+
+import collections
+import threading
+import time
+
+MISSING = object()
+
+
+class ResponseCache(object):
+    """Bounded LRU cache of decoded GET responses with per-resource TTLs.
+
+    Entries are grouped by namespace (the manager's `cache_namespace`, e.g.
+    'dashboards') so writes through a manager can drop everything it may
+    have changed.
+
+    Values are returned as stored, not copied, so every caller shares them
+    and must treat them as read-only. Managers hand out private copies of
+    documents meant to be edited (see BaseManager._get_body).
+
+    :param maxsize: maximum number of cached responses
+    :param ttl: default time to live in seconds
+    :param ttls: dict of namespace to time to live overriding `ttl`
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, ttls=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, namespace, key):
+        """Return the cached value or MISSING."""
+        with self._lock:
+            entry = self._data.pop((namespace, key), None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return MISSING
+            # Re-insert to mark as most recently used.
+            self._data[(namespace, key)] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, namespace, key, value):
+        ttl = self.ttls.get(namespace, self.ttl)
+        if not ttl:
+            return
+        with self._lock:
+            self._data.pop((namespace, key), None)
+            self._data[(namespace, key)] = (time.time() + ttl, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, namespace=None):
+        """Drop every entry of `namespace`, or everything if not given."""
+        with self._lock:
+            if namespace is None:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if k[0] == namespace]:
+                del self._data[key]
+
+    def stats(self):
+        """Return hit/miss counters and the current size."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._data), 'maxsize': self.maxsize}
@@ -0,0 +1,240 @@
+# Copyright 2016 Time Warner Cable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Helpers for running API calls concurrently on a bounded thread pool.
+"""
+
+import os
+import threading
+import time
+
+
+class BatchResult(object):
+    """Outcome of a batch operation.
+
+    `results` maps each item key to its result and `errors` maps each
+    failed item key to the exception raised for it.
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.errors = {}
+        self.skipped = []
+
+    def __repr__(self):
+        return '<BatchResult: %d ok, %d failed, %d skipped>' % (
+            len(self.results), len(self.errors), len(self.skipped))
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+class Checkpoint(object):
+    """Append-only record of completed item keys.
+
+    Lets a failed batch be resumed without redoing finished items.
+
+    :param path: file the completed keys are written to, one per line
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done.update(line.rstrip('\n') for line in f if line.strip())
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def mark(self, key):
+        """Record `key` as completed."""
+        with self._lock:
+            self.done.add(key)
+            with open(self.path, 'a') as f:
+                f.write('%s\n' % key)
+
+
+def run_batch(func, items, key=None, max_workers=8, progress=None,
+              checkpoint=None):
+    """Run `func` over `items` concurrently and collect a BatchResult.
+
+    Errors are captured per item instead of aborting the batch.
+
+    :param func: callable taking a single item
+    :param items: iterable of items
+    :param key: callable returning the key of an item (defaults to the item)
+    :param max_workers: maximum number of concurrent calls
+    :param progress: callable invoked as ``progress(done, failed)`` after
+        every finished item
+    :param checkpoint: optional Checkpoint; items already in it are skipped
+        and finished items are added to it
+    """
+    if key is None:
+        key = lambda item: item
+    batch = BatchResult()
+
+    def todo():
+        for item in items:
+            if checkpoint is not None and key(item) in checkpoint:
+                batch.skipped.append(key(item))
+                continue
+            yield item
+
+    for item, result, error in imap_unordered(func, todo(), max_workers):
+        item_key = key(item)
+        if error is not None:
+            batch.errors[item_key] = error
+        else:
+            batch.results[item_key] = result
+            if checkpoint is not None:
+                checkpoint.mark(item_key)
+        if progress is not None:
+            progress(len(batch.results), len(batch.errors))
+    return batch
+
+
+def imap_unordered(func, items, max_workers=8, executor=None):
+    """Run `func` over `items` concurrently.
+
+    Yields ``(item, result, error)`` tuples in completion order. At most
+    ``2 * max_workers`` items are in flight at once, so `items` may be an
+    arbitrarily long iterator.
+
+    :param func: callable taking a single item
+    :param items: iterable of items
+    :param max_workers: maximum number of concurrent calls
+    :param executor: optional executor to run on instead of a private one
+    """
+    from concurrent import futures
+
+    own_executor = executor is None
+    if own_executor:
+        executor = futures.ThreadPoolExecutor(max_workers)
+    pending = {}
+    items = iter(items)
+    try:
+        for item in items:
+            pending[executor.submit(func, item)] = item
+            if len(pending) < 2 * max_workers:
+                continue
+            for result in _drain(pending, futures.FIRST_COMPLETED):
+                yield result
+        while pending:
+            for result in _drain(pending, futures.FIRST_COMPLETED):
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=False)
+
+
+def _drain(pending, return_when):
+    from concurrent import futures
+
+    done, _ = futures.wait(list(pending), return_when=return_when)
+    for future in done:
+        item = pending.pop(future)
+        error = future.exception()
+        if error is not None:
+            yield item, None, error
+        else:
+            yield item, future.result(), None
+
+
+class _Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesces concurrent identical calls into one.
+
+    While a call for a key is in flight, other callers asking for the same
+    key wait for it and receive its result (or exception) instead of
+    issuing their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """Return ``func()``, sharing an in-flight call for `key`."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class MicroBatcher(object):
+    """Serves lookups issued within a short window from one bulk fetch.
+
+    The first lookup of a batch waits `window` seconds for others to join,
+    then calls `fetch_all` once and hands every caller its item.
+
+    :param fetch_all: callable returning a dict of every item by key
+    :param window: seconds a batch stays open for more lookups
+    """
+
+    def __init__(self, fetch_all, window=0.002):
+        self.fetch_all = fetch_all
+        self.window = window
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def get(self, key):
+        """Return the item for `key`; raises KeyError if there is none."""
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Call()
+        if leader:
+            time.sleep(self.window)
+            with self._lock:
+                self._batch = None
+            try:
+                batch.result = self.fetch_all()
+            except Exception as e:
+                batch.error = e
+            batch.event.set()
+        else:
+            batch.event.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.result[key]
@@ -0,0 +1,52 @@
+# Copyright 2016 Time Warner Cable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Exceptions raised by the Grafana client.
+"""
+
+
+class GrafanaException(Exception):
+    """Base class for client errors."""
+
+
+class HTTPException(GrafanaException):
+    """Grafana answered with an error status.
+
+    The single argument is the decoded error body with a `status_code` key
+    added, as raised by earlier versions of the client.
+    """
+
+    def __init__(self, details):
+        super(HTTPException, self).__init__(details)
+        self.details = details
+        self.status_code = details.get('status_code')
+
+
+class NotFound(GrafanaException, LookupError):
+    """No resource matches the requested name."""
+
+
+class PatchError(GrafanaException, ValueError):
+    """A JSON patch operation does not apply to the document."""
+
+
+class CommunicationError(GrafanaException):
+    """Grafana could not be reached or did not answer in time."""
+
+
+class CircuitOpenError(CommunicationError):
+    """Requests to an endpoint are failing fast after repeated errors."""
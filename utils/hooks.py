@@ -0,0 +1,160 @@
+# Copyright 2016 Time Warner Cable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Instrumentation hooks for HTTPClient.
+
+A hook is any object with `before_request(event)` and/or
+`after_request(event)` methods. Register hooks with ``hooks=[...]`` or
+HTTPClient.add_hook; with none registered no events are built.
+"""
+
+import bisect
+import re
+import threading
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+_NAMED_SEGMENT = re.compile(r'/(db|uid)/[^/]+')
+
+
+def url_template(url):
+    """Turn a partial URL into its route, e.g. '/api/orgs/{id}/users'."""
+    path = url.split('?', 1)[0]
+    path = _NAMED_SEGMENT.sub(lambda m: '/%s/{%s}' % (
+        m.group(1), 'slug' if m.group(1) == 'db' else 'uid'), path)
+    return _ID_SEGMENT.sub('/{id}', path)
+
+
+class RequestEvent(object):
+    """Details of one API request passed to hooks.
+
+    `status`, `latency` (seconds), `response_bytes` and `error` are only
+    set for after_request. `attempts` counts retries as well and
+    `throttled` is the time (included in `latency`) spent waiting on the
+    client-side rate limiter.
+    """
+
+    __slots__ = ('method', 'url', 'template', 'request_bytes', 'status',
+                 'latency', 'response_bytes', 'attempts', 'throttled',
+                 'error')
+
+    def __init__(self, method, url, request_bytes):
+        self.method = method
+        self.url = url
+        self.template = url_template(url)
+        self.request_bytes = request_bytes
+        self.status = None
+        self.latency = None
+        self.response_bytes = None
+        self.attempts = 0
+        self.throttled = 0.0
+        self.error = None
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class LatencyHistogram(object):
+    """Minimal labelled histogram with the prometheus_client interface.
+
+    ``histogram.labels(method, template, status).observe(seconds)``.
+    """
+
+    DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10,
+                       float('inf'))
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def labels(self, *labels):
+        return _Series(self, labels)
+
+    def _observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {
+                    'counts': [0] * len(self.buckets), 'sum': 0.0,
+                    'count': 0}
+            series['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def collect(self):
+        """Return ``{labels: {'buckets', 'sum', 'count'}}``.
+
+        Bucket counts are cumulative, as in the Prometheus exposition.
+        """
+        with self._lock:
+            result = {}
+            for labels, series in self._series.items():
+                total, cumulative = 0, []
+                for upper, count in zip(self.buckets, series['counts']):
+                    total += count
+                    cumulative.append((upper, total))
+                result[labels] = {'buckets': cumulative,
+                                  'sum': series['sum'],
+                                  'count': series['count']}
+            return result
+
+
+class _Series(object):
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def observe(self, value):
+        self.histogram._observe(self.labels, value)
+
+
+class PrometheusHook(object):
+    """Records request latency in a Prometheus-style histogram.
+
+    :param histogram: histogram labelled by method, URL template and status,
+        e.g. a prometheus_client.Histogram created with
+        ``labelnames=['method', 'template', 'status']``. Defaults to a new
+        LatencyHistogram.
+    """
+
+    def __init__(self, histogram=None):
+        self.histogram = histogram or LatencyHistogram()
+
+    def after_request(self, event):
+        status = event.status if event.status is not None else 'error'
+        self.histogram.labels(event.method, event.template,
+                              str(status)).observe(event.latency)
+
+
+class LoggingHook(object):
+    """Logs one structured record per request.
+
+    The event fields are attached to the record as `grafana_request`.
+    """
+
+    def __init__(self, logger=None, level=None):
+        import logging
+
+        self.logger = logger or logging.getLogger('grafanaclient.http')
+        self.level = logging.DEBUG if level is None else level
+
+    def after_request(self, event):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        self.logger.log(
+            self.level, '%s %s %s %.3fs',
+            event.method, event.template, event.status or event.error,
+            event.latency, extra={'grafana_request': event.to_dict()})
@@ -13,16 +13,24 @@
 # implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import copy
 import json
 import os
-import requests
+import six
 import socket
+import threading
+import time
 
-from requests.auth import HTTPBasicAuth
+from . import concurrency
+from . import exceptions
+from . import hooks
+from . import jsonutils
+from . import retry
 
 
 def get_system_ca_file():
     """Return path to system default CA file."""
+    import requests
     # Standard CA file locations for Debian/Ubuntu, RedHat/Fedora,
     # Suse, FreeBSD/OpenBSD, MacOSX, and the bundled ca
     ca_path = ['/etc/ssl/certs/ca-certificates.crt',
@@ -36,7 +44,147 @@ def get_system_ca_file():
             return ca
 
 
+class CredentialCache(object):
+    """Thread-safe store of Grafana session cookies.
+
+    Lets every HTTPClient of a process that talks to the same endpoint
+    with the same username and password share one login session. Sessions
+    are keyed by a salted digest of the password, so a client with the
+    right username but a wrong password never reuses another's session.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cookies = {}
+        self._login_locks = {}
+        self._salt = os.urandom(16)
+
+    def key(self, endpoint, username, password):
+        """Return the cache key of a login."""
+        import hashlib
+
+        password = password or ''
+        if isinstance(password, six.text_type):
+            password = password.encode('utf-8')
+        digest = hashlib.sha256(self._salt + password).hexdigest()
+        return (endpoint, username, digest)
+
+    def get(self, key):
+        with self._lock:
+            return self._cookies.get(key)
+
+    def set(self, key, cookies):
+        with self._lock:
+            self._cookies[key] = cookies
+
+    def invalidate(self, key):
+        with self._lock:
+            self._cookies.pop(key, None)
+
+    def login_lock(self, key):
+        """Lock serializing logins for `key`."""
+        with self._lock:
+            return self._login_locks.setdefault(key, threading.Lock())
+
+
+class TransferStats(object):
+    """Raw vs on-the-wire byte counters of JSON requests and responses."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_raw = 0
+        self.request_sent = 0
+        self.response_raw = 0
+        self.response_received = 0
+
+    def add_request(self, raw, sent):
+        with self._lock:
+            self.request_raw += raw
+            self.request_sent += sent
+
+    def add_response(self, raw, received):
+        with self._lock:
+            self.response_raw += raw
+            self.response_received += received
+
+    def to_dict(self):
+        with self._lock:
+            return {'request_raw': self.request_raw,
+                    'request_sent': self.request_sent,
+                    'response_raw': self.response_raw,
+                    'response_received': self.response_received}
+
+
+def gzip_compress(data):
+    import gzip
+    import io
+
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+# Process-wide cache used unless a client is given its own.
+credential_cache = CredentialCache()
+
+
 class HTTPClient(object):
+    """HTTP transport for the Grafana API.
+
+    Requests are sent through a single long-lived :class:`requests.Session`
+    so TCP connections (and TLS sessions) are reused between calls.
+
+    :param integer pool_connections: Number of per-host connection pools to
+                                     cache. (optional)
+    :param integer pool_maxsize: Maximum number of connections kept open to
+                                 a single host. (optional)
+    :param boolean pool_block: Block when no connection is free instead of
+                               opening a throwaway one. (optional)
+    :param boolean keep_alive: Keep connections open between requests.
+                               (optional, defaults to True)
+    :param adapter: requests HTTPAdapter to send through instead of a
+                    private one, sharing its connection pool with other
+                    clients. It is not closed by close(). (optional)
+    :param retry: RetryPolicy applied to failed requests. Safe methods are
+                  retried by default, writes only when the policy or the
+                  request (``retry=True``) opts in. (optional)
+    :param circuit_breaker: CircuitBreaker failing fast on endpoints that
+                            keep erroring. (optional)
+    :param cache: ResponseCache for GET calls made through the managers.
+                  Cached bodies are shared; documents returned for editing,
+                  e.g. DashboardJson._json, are private copies. (optional)
+    :param boolean coalesce: Share one request between concurrent identical
+                             GETs made through the managers. Callers then
+                             receive the same decoded body. (optional)
+    :param boolean compact_resources: Keep resource fields in a single dict
+                                      instead of per-instance attributes.
+                                      (optional)
+    :param integer gzip_threshold: Gzip JSON request bodies larger than this
+                                   many bytes. Responses are always
+                                   requested gzipped. (optional, Grafana
+                                   must accept gzipped request bodies)
+    :param rate_limiter: RateLimiter throttling requests client-side.
+                         (optional)
+    :param hooks: instrumentation hooks, see utils.hooks. (optional)
+    :param integer org_id: Org every request is scoped to. (optional)
+    :param credential_cache: CredentialCache sharing login sessions between
+                             clients, None to disable sharing. (optional,
+                             defaults to the process-wide cache)
+    :param boolean thread_safe: Refuse operations that change state shared
+                                by every thread using the client, such as
+                                switching the user's current org.
+                                (optional)
+
+    Clients authenticating with a username and password log in lazily, on
+    their first request, and log in again when the session expires.
+
+    A client may be shared between threads: request headers are built per
+    call, logins are serialized and the connection pool, caches and
+    limiters are synchronized. Use scoped() rather than switch_org to act
+    on another org from one of them.
+    """
+
     def __init__(self, endpoint, write_timeout=None, read_timeout=None, **kwargs):
         if endpoint.endswith('/'):
             endpoint = endpoint[:-1]
@@ -48,6 +196,8 @@ class HTTPClient(object):
         self.username = kwargs.get('username')
         self.password = kwargs.get('password')
         self.cookie = None
+        self.credential_cache = kwargs.get('credential_cache',
+                                           credential_cache)
 
         self.cert_file = kwargs.get('cert_file')
         self.key_file = kwargs.get('key_file')
@@ -64,8 +214,94 @@ class HTTPClient(object):
             if kwargs.get('insecure'):
                 self.verify_cert = False
             else:
-                self.verify_cert = kwargs.get(
-                    'os_cacert', get_system_ca_file())
+                # None is resolved to the system CA file along with the
+                # session, see _create_session.
+                self.verify_cert = kwargs.get('os_cacert')
+
+        self.pool_connections = kwargs.get('pool_connections', 10)
+        self.pool_maxsize = kwargs.get('pool_maxsize', 10)
+        self.pool_block = kwargs.get('pool_block', False)
+        self.keep_alive = kwargs.get('keep_alive', True)
+        self.adapter = kwargs.get('adapter')
+        self.thread_safe = kwargs.get('thread_safe', False)
+        # Built on first use so importing and constructing the client does
+        # not load the HTTP stack.
+        self._session = None
+        self._session_lock = threading.Lock()
+        # Serializes logins when no credential cache does.
+        self._login_lock = threading.Lock()
+
+        self.retry = kwargs.get('retry') or retry.RetryPolicy()
+        self.circuit_breaker = kwargs.get('circuit_breaker')
+        self.rate_limiter = kwargs.get('rate_limiter')
+        self.gzip_threshold = kwargs.get('gzip_threshold')
+        self.transfer_stats = TransferStats()
+        self.cache = kwargs.get('cache')
+        self.compact_resources = kwargs.get('compact_resources', False)
+        self.single_flight = None
+        if kwargs.get('coalesce'):
+            self.single_flight = concurrency.SingleFlight()
+        self.hooks = list(kwargs.get('hooks') or [])
+        # Org requests are scoped to with the X-Grafana-Org-Id header, set
+        # by switch_org or scoped(); None uses the user's current org.
+        self.org_id = kwargs.get('org_id')
+
+    @property
+    def session(self):
+        """The pooled :class:`requests.Session` shared by every request."""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self):
+        """Build the pooled session shared by every request."""
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = self.adapter
+        if adapter is None:
+            adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                  pool_maxsize=self.pool_maxsize,
+                                  pool_block=self.pool_block)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        if self.cert_file and self.key_file:
+            session.cert = (self.cert_file, self.key_file)
+        verify = self.verify_cert
+        if verify is None and self.endpoint.startswith('https'):
+            verify = get_system_ca_file()
+        if verify is not None:
+            session.verify = verify
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def close(self):
+        """Close every pooled connection, unless the pool is shared."""
+        if self._session is not None and self.adapter is None:
+            self._session.close()
+
+    def scoped(self, org_id):
+        """Return a client whose requests act on org `org_id`.
+
+        The scoped client shares this client's connection pool, session,
+        cache and hooks. Unlike switch_org it does not change the user's
+        current org on the server, so scoped clients for different orgs
+        can be used concurrently.
+        """
+        # Build the session first so the copy shares it.
+        self.session
+        scoped = copy.copy(self)
+        scoped.org_id = org_id
+        return scoped
+
+    def add_hook(self, hook):
+        """Register an instrumentation hook, see utils.hooks."""
+        self.hooks.append(hook)
 
     def _http_request(self, url, method, **kwargs):
         """Send an http request with the specified characteristics.
@@ -73,85 +309,199 @@ class HTTPClient(object):
         Wrapper around requests.request to handle tasks such as
         setting headers and error handling.
         """
+        if not self.hooks:
+            return self._do_http_request(url, method, None, **kwargs)
+
+        event = hooks.RequestEvent(method, url, len(kwargs.get('data') or ''))
+        for hook in self.hooks:
+            if hasattr(hook, 'before_request'):
+                hook.before_request(event)
+        start = time.time()
+        try:
+            resp = self._do_http_request(url, method, event, **kwargs)
+        except Exception as e:
+            event.error = e
+            event.status = getattr(e, 'status_code', None)
+            raise
+        else:
+            event.status = resp.status_code
+            if kwargs.get('stream'):
+                length = resp.headers.get('Content-Length')
+                event.response_bytes = int(length) if length else None
+            else:
+                event.response_bytes = len(resp.content)
+        finally:
+            event.latency = time.time() - start
+            for hook in self.hooks:
+                if hasattr(hook, 'after_request'):
+                    hook.after_request(event)
+        return resp
+
+    def _do_http_request(self, url, method, event, **kwargs):
 
+        login_request = kwargs.pop('login', False)
+        if self.org_id is not None and not login_request:
+            kwargs['headers'].setdefault('X-Grafana-Org-Id', str(self.org_id))
         auth = None
         if self.api_token:
             kwargs['headers'].setdefault('Authorization', 'Bearer ' + self.api_token)
-        elif 'login' in kwargs:
-            del kwargs['login']
-        elif not self.cookie:
-            auth = HTTPBasicAuth(self.username, self.password)
-
-        if self.cert_file and self.key_file:
-            kwargs['cert'] = (self.cert_file, self.key_file)
-
-        if self.verify_cert is not None:
-            kwargs['verify'] = self.verify_cert
+        elif not login_request:
+            if self.cookie is None and self.username:
+                self._ensure_login()
+            if not self.cookie:
+                from requests.auth import HTTPBasicAuth
+                auth = HTTPBasicAuth(self.username, self.password)
 
         timeout = None
         if method in ['POST', 'DELETE', 'PUT', 'PATCH']:
             timeout = self.write_timeout
-        elif method is 'GET':
+        elif method == 'GET':
             timeout = self.read_timeout
+        timeout = kwargs.pop('timeout', timeout)
+
+        retry_request = kwargs.pop('retry', None)
+        resp = self._send_with_retries(method, url, timeout, auth,
+                                       retry_request, event, **kwargs)
+        if resp.status_code == 401 and self.cookie and auth is None \
+                and not self.api_token and not login_request:
+            # The session expired: log in again and replay the request.
+            resp.close()
+            self._ensure_login(expired=self.cookie)
+            resp = self._send_with_retries(method, url, timeout, auth,
+                                           retry_request, event, **kwargs)
+
+        if resp.status_code not in (200, 304):
+            e = {}
+            if resp.content:
+                try:
+                    e = json.loads(resp.content)
+                except:
+                    e['message'] = resp.content
+            e['status_code'] = resp.status_code
+            raise exceptions.HTTPException(e)
+
+        return resp
+
+    def _send_with_retries(self, method, url, timeout, auth, retry_request,
+                           event, **kwargs):
+        key = retry.endpoint_key(url)
+        attempt = 0
+        while True:
+            if self.circuit_breaker:
+                self.circuit_breaker.before(key)
+            if self.rate_limiter is not None:
+                throttled = self.rate_limiter.acquire(method, url)
+                if event is not None:
+                    event.throttled += throttled
+            if event is not None:
+                event.attempts += 1
+            retry_after = None
+            try:
+                resp = self._send(method, url, timeout, auth, **kwargs)
+            except exceptions.CommunicationError:
+                self._record_outcome(key, False)
+                if not self.retry.allows(method, attempt, retry_request):
+                    raise
+            else:
+                self._record_outcome(key, resp.status_code < 500 and
+                                     resp.status_code != 429)
+                if (resp.status_code not in self.retry.status_forcelist or
+                        not self.retry.allows(method, attempt, retry_request)):
+                    return resp
+                retry_after = retry.parse_retry_after(
+                    resp.headers.get('Retry-After'))
+                resp.close()
+            time.sleep(self.retry.backoff(attempt, retry_after))
+            attempt += 1
+
+    def _record_outcome(self, key, ok):
+        if self.circuit_breaker is None:
+            return
+        if ok:
+            self.circuit_breaker.success(key)
+        else:
+            self.circuit_breaker.failure(key)
+
+    def _send(self, method, url, timeout, auth, **kwargs):
+        import requests
 
         try:
-            resp = requests.request(
+            return self.session.request(
                 method,
                 self.endpoint + url,
                 timeout=timeout,
                 auth=auth,
-                cookies=self.cookie,
                 **kwargs)
+        except requests.Timeout as e:
+            endpoint = self.endpoint
+            message = ("Error %(method)s timeout request to %(endpoint)s %(e)s" %
+                       {'method': method, 'endpoint': endpoint, 'e': e})
+            raise exceptions.CommunicationError(message)
         except socket.gaierror as e:
             message = ("Error finding address for %(url)s: %(e)s" %
                        {'url': self.endpoint + url, 'e': e})
-            raise Exception(message=message)
-        except (socket.error, socket.timeout) as e:
+            raise exceptions.CommunicationError(message)
+        except (requests.ConnectionError, socket.error, socket.timeout) as e:
             endpoint = self.endpoint
             message = ("Error communicating with %(endpoint)s %(e)s" %
                        {'endpoint': endpoint, 'e': e})
-            raise Exception(message=message)
-        except requests.Timeout as e:
-            endpoint = self.endpoint
-            message = ("Error %(method)s timeout request to %(endpoint)s %(e)s" %
-                       {'method': method, 'endpoint': endpoint, 'e': e})
-            raise Exception(message=message)
+            raise exceptions.CommunicationError(message)
 
-        if resp.status_code != 200:
-            e = {}
-            if resp.content:
-                try:
-                    e = json.loads(resp.content)
-                except:
-                    e['message'] = resp.content
-            e['status_code'] = resp.status_code
-            raise Exception(e)
+    def _json_http_request(self, method, url, **kwargs):
+        # Never modify the caller's headers; they may be shared by threads.
+        kwargs['headers'] = dict(kwargs.get('headers') or {})
+        kwargs['headers'].setdefault('Content-Type', 'application/json')
+        kwargs['headers'].setdefault('Accept', 'application/json')
+        kwargs['headers'].setdefault('Accept-Encoding', 'gzip')
+        if 'json' in kwargs:
+            data = kwargs.pop('json')
+            if data is not None:
+                kwargs['data'] = jsonutils.dumps(data).encode('utf-8')
+        data = kwargs.get('data')
+        if data:
+            if isinstance(data, six.text_type):
+                data = data.encode('utf-8')
+            raw = len(data)
+            if self.gzip_threshold is not None and raw > self.gzip_threshold:
+                kwargs['data'] = data = gzip_compress(data)
+                kwargs['headers']['Content-Encoding'] = 'gzip'
+            self.transfer_stats.add_request(raw, len(data))
 
-        return resp
+        return self._http_request(url, method, **kwargs)
 
     def json_request(self, method, url, **kwargs):
-        kwargs.setdefault('headers', {})
-        kwargs['headers'].setdefault('Content-Type', 'application/json')
-        kwargs['headers'].setdefault('Accept', 'application/json')
+        """Send a JSON request and decode the response body once.
 
-        resp = self._http_request(url, method, **kwargs)
-        body = resp.content
-        if 'application/json' in resp.headers.get('content-type', ''):
-                body = resp.json()
-        else:
-            body = None
+        Returns a ``(response, body)`` tuple where `body` is the decoded
+        JSON document, or None when the response is not JSON.
+        """
+        resp = self._json_http_request(method, url, **kwargs)
+        body = None
+        if (resp.content and
+                'application/json' in resp.headers.get('content-type', '')):
+            body = jsonutils.loads(resp.content)
+        self.transfer_stats.add_response(len(resp.content),
+                                         self._received_bytes(resp))
 
         return resp, body
 
+    @staticmethod
+    def _received_bytes(resp):
+        """Bytes of `resp` read off the wire, before content decoding."""
+        try:
+            return resp.raw.tell()
+        except (AttributeError, IOError):
+            return int(resp.headers.get('Content-Length') or
+                       len(resp.content))
+
     def raw_request(self, method, url, **kwargs):
-        kwargs.setdefault('headers', {})
+        kwargs['headers'] = dict(kwargs.get('headers') or {})
         kwargs['headers'].setdefault('Content-Type',
                                      'application/octet-stream')
         return self._http_request(url, method, **kwargs)
 
     def client_request(self, method, url, **kwargs):
-        resp, body = self.json_request(method, url, **kwargs)
-        return resp
+        return self._json_http_request(method, url, **kwargs)
 
     def head(self, url, **kwargs):
         return self.client_request("HEAD", url, **kwargs)
@@ -182,4 +532,34 @@ class HTTPClient(object):
             'login': True,
         }
         data = self.post('/login', json=json, login=True)
-        self.cookie = data.cookies
+        self._use_cookie(data.cookies.get_dict())
+        if self.credential_cache is not None:
+            self.credential_cache.set(self._credential_key(), self.cookie)
+
+    def _credential_key(self):
+        return self.credential_cache.key(self.endpoint, self.username,
+                                         self.password)
+
+    def _use_cookie(self, cookie):
+        # The session sends the login cookie with every later request.
+        self.cookie = cookie
+        self.session.cookies.update(cookie)
+
+    def _ensure_login(self, expired=None):
+        """Log in unless a usable session is already shared.
+
+        :param expired: session cookie known to be expired, if any
+        """
+        if self.credential_cache is None:
+            with self._login_lock:
+                if self.cookie is None or self.cookie is expired:
+                    self.login()
+            return
+        key = self._credential_key()
+        with self.credential_cache.login_lock(key):
+            cookie = self.credential_cache.get(key)
+            if cookie is not None and cookie is not expired:
+                self._use_cookie(cookie)
+            else:
+                self.credential_cache.invalidate(key)
+                self.login()
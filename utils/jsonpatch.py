@@ -0,0 +1,298 @@
+# Copyright 2016 Time Warner Cable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Structural diff and patch of decoded JSON documents (RFC 6902 style).
+
+A patch is a list of operations such as::
+
+    [{'op': 'replace', 'path': '/panels/0/targets/0/expr', 'value': 'up'},
+     {'op': 'remove', 'path': '/tags/1'}]
+
+:func:`apply` never modifies its input. Only the containers on the paths
+being changed are copied, and everything else is shared with the original
+document. Patching one field of a multi-MB dashboard therefore costs about
+as much as the depth of that field, and a decoded body held by the
+response cache can be patched safely. When no operation changes anything,
+the original document itself is returned.
+"""
+
+import six
+
+from . import exceptions
+
+_MISSING = object()
+
+
+def parse_pointer(path):
+    """Split a JSON pointer into its unescaped reference tokens."""
+    if not path:
+        return []
+    if not path.startswith('/'):
+        raise exceptions.PatchError('Invalid JSON pointer: %r' % path)
+    return [token.replace('~1', '/').replace('~0', '~')
+            for token in path[1:].split('/')]
+
+
+def make_pointer(tokens):
+    """Build a JSON pointer from reference tokens."""
+    return ''.join('/' + six.text_type(token).replace('~', '~0')
+                   .replace('/', '~1') for token in tokens)
+
+
+def _index(container, token, path, append=False):
+    if isinstance(container, dict):
+        return token
+    if not isinstance(container, list):
+        raise exceptions.PatchError('%s does not refer into a container' %
+                                    path)
+    if append and token == '-':
+        return len(container)
+    try:
+        index = int(token)
+    except ValueError:
+        raise exceptions.PatchError('Invalid array index in %s' % path)
+    if index < 0 or index > len(container) - (0 if append else 1):
+        raise exceptions.PatchError('Array index out of range in %s' % path)
+    return index
+
+
+def resolve(doc, path):
+    """Return the value `path` points to in `doc`."""
+    value = doc
+    for token in parse_pointer(path):
+        index = _index(value, token, path)
+        try:
+            value = value[index]
+        except KeyError:
+            raise exceptions.PatchError('%s does not exist' % path)
+    return value
+
+
+def _same(a, b):
+    """Return whether `a` and `b` are equal the way diff compares them.
+
+    Unlike ``==``, values of different types differ, so ``True`` does not
+    match ``1`` and ``1.0`` does not match ``1``.
+    """
+    if a is b:
+        return True
+    if isinstance(a, dict) and isinstance(b, dict):
+        return len(a) == len(b) and all(
+            key in b and _same(value, b[key]) for key, value in a.items())
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(
+            _same(x, y) for x, y in zip(a, b))
+    return type(a) is type(b) and a == b
+
+
+def _own(node, fresh):
+    """Return a container of `node` that this apply may modify."""
+    if id(node) in fresh:
+        return node
+    copy = list(node) if isinstance(node, list) else dict(node)
+    # Keep a reference so the id cannot be reused by another object.
+    fresh[id(copy)] = copy
+    return copy
+
+
+def _update(node, tokens, path, func, fresh):
+    """Return `node` with func applied to the parent of the target.
+
+    `func(container, token)` modifies the parent container of the target
+    and returns whether it changed anything. Containers shared with the
+    input document are copied first; copies made earlier by the same apply
+    (tracked in `fresh`) are modified in place, so a patch of many
+    operations copies every container at most once. `node` itself is
+    returned when nothing changed.
+    """
+    if len(tokens) == 1:
+        if not isinstance(node, (dict, list)):
+            raise exceptions.PatchError(
+                '%s does not refer into a container' % path)
+        if id(node) in fresh:
+            func(node, tokens[0])
+            return node
+        copy = list(node) if isinstance(node, list) else dict(node)
+        if not func(copy, tokens[0]):
+            return node
+        fresh[id(copy)] = copy
+        return copy
+    index = _index(node, tokens[0], path)
+    try:
+        child = node[index]
+    except KeyError:
+        raise exceptions.PatchError('%s does not exist' % path)
+    new_child = _update(child, tokens[1:], path, func, fresh)
+    if new_child is child:
+        return node
+    node = _own(node, fresh)
+    node[index] = new_child
+    return node
+
+
+def _add(doc, path, value, fresh):
+    tokens = parse_pointer(path)
+    if not tokens:
+        return value
+
+    def add(container, token):
+        index = _index(container, token, path, append=True)
+        if isinstance(container, list):
+            container.insert(index, value)
+            return True
+        if _same(container.get(index, _MISSING), value):
+            return False
+        container[index] = value
+        return True
+    return _update(doc, tokens, path, add, fresh)
+
+
+def _remove(doc, path, fresh):
+    tokens = parse_pointer(path)
+    if not tokens:
+        raise exceptions.PatchError('Cannot remove the whole document')
+
+    def remove(container, token):
+        index = _index(container, token, path)
+        try:
+            del container[index]
+        except KeyError:
+            raise exceptions.PatchError('%s does not exist' % path)
+        return True
+    return _update(doc, tokens, path, remove, fresh)
+
+
+def _replace(doc, path, value, fresh):
+    tokens = parse_pointer(path)
+    if not tokens:
+        return value
+
+    def replace(container, token):
+        index = _index(container, token, path)
+        current = container.get(index, _MISSING) \
+            if isinstance(container, dict) else container[index]
+        if current is _MISSING:
+            raise exceptions.PatchError('%s does not exist' % path)
+        if _same(current, value):
+            return False
+        container[index] = value
+        return True
+    return _update(doc, tokens, path, replace, fresh)
+
+
+def _member(operation, name):
+    try:
+        return operation[name]
+    except KeyError:
+        raise exceptions.PatchError('Operation %r has no %r' %
+                                    (operation, name))
+
+
+def apply_operation(doc, operation, fresh=None):
+    """Apply a single patch operation and return the resulting document.
+
+    :param fresh: containers created by earlier operations of the same
+        patch, by id; they are modified in place
+    """
+    if fresh is None:
+        fresh = {}
+    try:
+        op = operation['op']
+        path = operation['path']
+    except (KeyError, TypeError):
+        raise exceptions.PatchError('Invalid operation: %r' % (operation,))
+    if op == 'add':
+        return _add(doc, path, _member(operation, 'value'), fresh)
+    if op == 'remove':
+        return _remove(doc, path, fresh)
+    if op == 'replace':
+        return _replace(doc, path, _member(operation, 'value'), fresh)
+    if op in ('move', 'copy'):
+        source = _member(operation, 'from')
+        value = resolve(doc, source)
+        if op == 'copy':
+            # The value is now referenced twice; stop modifying in place.
+            fresh.clear()
+            return _add(doc, path, value, fresh)
+        if source == path:
+            return doc
+        if path.startswith(source + '/'):
+            raise exceptions.PatchError('Cannot move %s into itself' %
+                                        source)
+        return _add(_remove(doc, source, fresh), path, value, fresh)
+    if op == 'test':
+        if not _same(resolve(doc, path), _member(operation, 'value')):
+            raise exceptions.PatchError('Test failed at %s' % path)
+        return doc
+    raise exceptions.PatchError('Unknown operation: %r' % op)
+
+
+def apply(doc, patch):
+    """Apply the operations of `patch` in order and return the result.
+
+    `doc` is left untouched; it is returned as is when no operation
+    changes it. Raises PatchError if an operation does not apply, in which
+    case none of the patch takes effect.
+    """
+    fresh = {}
+    for operation in patch:
+        doc = apply_operation(doc, operation, fresh)
+    return doc
+
+
+def diff(src, dst):
+    """Return a patch turning `src` into `dst`.
+
+    Objects are compared key by key and arrays index by index; elements
+    added or removed at the end of an array become add/remove operations,
+    any other difference a replace. Subtrees shared by both documents
+    (e.g. those left alone by apply) are skipped without being walked.
+    """
+    patch = []
+    _diff(src, dst, [], patch)
+    return patch
+
+
+def _diff(src, dst, tokens, patch):
+    if src is dst:
+        return
+    if isinstance(src, dict) and isinstance(dst, dict):
+        for key in src:
+            if key not in dst:
+                patch.append({'op': 'remove',
+                              'path': make_pointer(tokens + [key])})
+        for key, value in six.iteritems(dst):
+            if key in src:
+                _diff(src[key], value, tokens + [key], patch)
+            else:
+                patch.append({'op': 'add',
+                              'path': make_pointer(tokens + [key]),
+                              'value': value})
+        return
+    if isinstance(src, list) and isinstance(dst, list):
+        common = min(len(src), len(dst))
+        for i in range(common):
+            _diff(src[i], dst[i], tokens + [i], patch)
+        for i in range(len(src) - 1, common - 1, -1):
+            patch.append({'op': 'remove',
+                          'path': make_pointer(tokens + [i])})
+        for i in range(common, len(dst)):
+            patch.append({'op': 'add', 'path': make_pointer(tokens + [i]),
+                          'value': dst[i]})
+        return
+    if type(src) is not type(dst) or src != dst:
+        patch.append({'op': 'replace', 'path': make_pointer(tokens),
+                      'value': dst})
@@ -0,0 +1,105 @@
+# Copyright 2016 Time Warner Cable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Pluggable JSON encoding and decoding.
+
+The fastest installed backend (orjson, then ujson, then the standard
+library) is picked on first use. Use :func:`set_backend` to force one.
+"""
+
+import functools
+import json
+
+import six
+
+
+def _stdlib_backend():
+    return json.loads, functools.partial(json.dumps, separators=(',', ':'))
+
+
+def _ujson_backend():
+    import ujson
+
+    def dumps(obj, sort_keys=False):
+        return ujson.dumps(obj, sort_keys=sort_keys)
+    return ujson.loads, dumps
+
+
+def _orjson_backend():
+    import orjson
+
+    def dumps(obj, sort_keys=False):
+        # Non-string keys are stringified, as the json module does.
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option).decode('utf-8')
+    return orjson.loads, dumps
+
+
+BACKENDS = {
+    'orjson': _orjson_backend,
+    'ujson': _ujson_backend,
+    'json': _stdlib_backend,
+}
+
+_backend = None
+_loads = None
+_dumps = None
+
+
+def set_backend(name):
+    """Select the JSON backend by name ('orjson', 'ujson' or 'json')."""
+    global _backend, _loads, _dumps
+    if name not in BACKENDS:
+        raise ValueError("Unknown JSON backend: %s" % name)
+    _loads, _dumps = BACKENDS[name]()
+    _backend = name
+
+
+def _select_backend():
+    for name in ('orjson', 'ujson', 'json'):
+        try:
+            set_backend(name)
+            return
+        except ImportError:
+            continue
+
+
+def get_backend():
+    """Return the name of the JSON backend in use."""
+    if _backend is None:
+        _select_backend()
+    return _backend
+
+
+def loads(data):
+    """Decode a JSON document from text or bytes."""
+    if _loads is None:
+        _select_backend()
+    if isinstance(data, six.binary_type) and _backend != 'orjson':
+        data = data.decode('utf-8')
+    return _loads(data)
+
+
+def dumps(obj, sort_keys=False):
+    """Encode `obj` as a compact JSON string, without extra whitespace.
+
+    With `sort_keys` equal documents always encode to the same string.
+    """
+    if _dumps is None:
+        _select_backend()
+    return _dumps(obj, sort_keys=sort_keys)
@@ -0,0 +1,120 @@
+# Copyright 2016 Time Warner Cable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Client-side rate limiting for HTTPClient.
+"""
+
+import threading
+import time
+
+from . import retry
+
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket.
+
+    :param rate: tokens added per second
+    :param burst: bucket capacity (defaults to one second worth of tokens)
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1, rate))
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """Take `tokens` and return how many seconds the caller must wait.
+
+        Tokens may go negative, so concurrent callers queue up fairly
+        instead of all waking at once.
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available; returns the seconds waited."""
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+class RateLimiter(object):
+    """Token buckets per method class and, optionally, per endpoint family.
+
+    :param read_rate: GET/HEAD/OPTIONS requests per second (None: unlimited)
+    :param write_rate: POST/PUT/PATCH/DELETE requests per second
+        (None: unlimited)
+    :param burst: bucket capacity for both classes (optional)
+    :param endpoints: dict of endpoint family (e.g. '/api/dashboards') to a
+        rate or ``(rate, burst)`` applied on top of the method class limit
+    """
+
+    def __init__(self, read_rate=None, write_rate=None, burst=None,
+                 endpoints=None):
+        self.buckets = {}
+        if read_rate:
+            self.buckets['read'] = TokenBucket(read_rate, burst)
+        if write_rate:
+            self.buckets['write'] = TokenBucket(write_rate, burst)
+        for family, limit in (endpoints or {}).items():
+            if not isinstance(limit, tuple):
+                limit = (limit, None)
+            self.buckets[family] = TokenBucket(*limit)
+        self._lock = threading.Lock()
+        self._stats = dict((name, {'requests': 0, 'throttled': 0,
+                                   'seconds': 0.0})
+                           for name in self.buckets)
+
+    def acquire(self, method, url):
+        """Wait until a `method` request to `url` is allowed.
+
+        :returns: total seconds spent throttled
+        """
+        names = ['write' if method in WRITE_METHODS else 'read',
+                 retry.endpoint_key(url)]
+        waited = 0.0
+        for name in names:
+            bucket = self.buckets.get(name)
+            if bucket is None:
+                continue
+            delay = bucket.acquire()
+            waited += delay
+            with self._lock:
+                stats = self._stats[name]
+                stats['requests'] += 1
+                if delay:
+                    stats['throttled'] += 1
+                    stats['seconds'] += delay
+        return waited
+
+    def stats(self):
+        """Return request, throttled request and throttled seconds counts
+        per bucket."""
+        with self._lock:
+            return dict((name, dict(stats))
+                        for name, stats in self._stats.items())
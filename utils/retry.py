@@ -0,0 +1,141 @@
+# Copyright 2016 Time Warner Cable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Retry policies and circuit breakers for HTTPClient.
+"""
+
+import random
+import threading
+import time
+
+from . import exceptions
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def endpoint_key(url):
+    """Group a partial URL by endpoint family, e.g. '/api/dashboards'."""
+    path = url.split('?', 1)[0]
+    parts = [part for part in path.split('/') if part]
+    return '/' + '/'.join(parts[:2])
+
+
+def parse_retry_after(value):
+    """Return the delay in seconds requested by a Retry-After header."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        # HTTP-date form; rare enough to import its parsers on demand.
+        import calendar
+        import email.utils
+
+        parsed = email.utils.parsedate(value)
+        if parsed is None:
+            return None
+        return max(0.0, calendar.timegm(parsed) - time.time())
+
+
+class RetryPolicy(object):
+    """Exponential backoff with full jitter.
+
+    :param total: maximum number of retries per request
+    :param backoff_factor: base delay in seconds; attempt `n` waits a random
+        time up to ``backoff_factor * 2 ** n``
+    :param max_backoff: upper bound for a single delay in seconds
+    :param status_forcelist: response codes that are retried
+    :param retry_writes: also retry POST/PUT/PATCH/DELETE requests
+    """
+
+    def __init__(self, total=3, backoff_factor=0.5, max_backoff=30,
+                 status_forcelist=(429, 502, 503, 504), retry_writes=False):
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.status_forcelist = status_forcelist
+        self.retry_writes = retry_writes
+
+    def allows(self, method, attempt, retry=None):
+        """Whether a failed `attempt` of a `method` request may be retried.
+
+        :param retry: per-request override; True opts a write in
+        """
+        if attempt >= self.total or retry is False:
+            return False
+        return (retry or self.retry_writes or method in SAFE_METHODS)
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to wait before retry number `attempt` + 1."""
+        delay = random.uniform(0, min(self.max_backoff,
+                                      self.backoff_factor * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_backoff))
+        return delay
+
+
+class NoRetry(RetryPolicy):
+    """Policy that never retries."""
+
+    def __init__(self):
+        super(NoRetry, self).__init__(total=0)
+
+
+class CircuitBreaker(object):
+    """Per-endpoint circuit breaker.
+
+    After `failure_threshold` consecutive failures on an endpoint family the
+    circuit opens and requests to it raise CircuitOpenError immediately.
+    After `reset_timeout` seconds one trial request is let through; its
+    outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = {}
+        self._opened = {}
+
+    def before(self, key):
+        """Raise CircuitOpenError if requests to `key` must fail fast."""
+        with self._lock:
+            opened = self._opened.get(key)
+            if opened is None:
+                return
+            if time.time() - opened < self.reset_timeout:
+                raise exceptions.CircuitOpenError(
+                    "Circuit open for %s after %d failures" %
+                    (key, self._failures[key]))
+            # Half-open: let this request through, hold back the others.
+            self._opened[key] = time.time()
+
+    def success(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+            self._opened.pop(key, None)
+
+    def failure(self, key):
+        with self._lock:
+            failures = self._failures.get(key, 0) + 1
+            self._failures[key] = failures
+            if failures >= self.failure_threshold:
+                self._opened[key] = time.time()
+
+    def is_open(self, key):
+        with self._lock:
+            return key in self._opened